@@ -0,0 +1,11 @@
+"""
+Benchmarks for gstatsd.  Run each one from the top of the source tree,
+e.g. `python -m bench.memory`, or all of them with `python -m bench.run`,
+which collects their JSON results into one document.
+
+    process     StatsDaemon._process throughput for several packet mixes
+    memory      memory held by one interval of Stats
+    protocol    plaintext vs pickle graphite protocol
+    flush       GraphiteSink.send across key counts and samples per key
+    e2e         load generator -> daemon -> fake carbon, measuring loss
+"""
@@ -0,0 +1,89 @@
+"""
+Fake carbon listeners for the benchmarks.
+"""
+
+# standard
+import SocketServer
+import threading
+import time
+from collections import defaultdict
+
+# vendor
+import gevent
+from gevent.server import StreamServer
+
+
+class FakeCarbon(object):
+
+    "Counts the bytes received on every connection."
+
+    def __init__(self):
+        self.received = 0
+        self.server = StreamServer(('127.0.0.1', 0), self._handle)
+        self.server.start()
+        self.port = self.server.server_port
+
+    def _handle(self, sock, addr):
+        while 1:
+            data = sock.recv(65536)
+            if not data:
+                break
+            self.received += len(data)
+
+    def wait(self, size, timeout=10):
+        end = time.time() + timeout
+        while self.received < size and time.time() < end:
+            gevent.sleep(0.01)
+
+
+class _LineHandler(SocketServer.StreamRequestHandler):
+
+    def handle(self):
+        carbon = self.server.carbon
+        for line in self.rfile:
+            parts = line.split()
+            if len(parts) == 3:
+                carbon.add(parts[0], float(parts[1]))
+
+
+class LineCarbon(object):
+
+    """
+    Plaintext protocol listener running in its own thread, for use from
+    code that is not driven by the gevent hub.  Values received for each
+    metric name are summed across flushes.
+    """
+
+    def __init__(self):
+        self.totals = defaultdict(float)
+        self.lines = 0
+        self.updated = time.time()
+        self._lock = threading.Lock()
+        self.server = SocketServer.ThreadingTCPServer(('127.0.0.1', 0),
+                                                      _LineHandler)
+        self.server.daemon_threads = True
+        self.server.carbon = self
+        self.port = self.server.server_address[1]
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+    def add(self, name, value):
+        with self._lock:
+            self.totals[name] += value
+            self.lines += 1
+            self.updated = time.time()
+
+    def get(self, name):
+        with self._lock:
+            return self.totals.get(name, 0.0)
+
+    def total(self, prefix, suffix=''):
+        "Sum of the values of every metric named prefix...suffix."
+        with self._lock:
+            return sum(val for name, val in self.totals.iteritems()
+                       if name.startswith(prefix) and name.endswith(suffix))
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
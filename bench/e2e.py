@@ -0,0 +1,139 @@
+"""
+End-to-end localhost benchmark: a load generator drives a running daemon,
+and a fake carbon listener checks that every metric made it through.
+
+    python -m bench.e2e [metrics] [keys] [rate] [workers]
+
+The daemon is started as `python -m gstatsd.service` with a one second
+flush interval (and -w workers).  The load generator sends metrics
+alternating counter increments and timings over the given number of keys,
+at up to rate metrics per second (0 sends as fast as possible): one per
+UDP datagram with StatsClient, packed with BufferedStatsClient, and one
+per datagram over the daemon's unix domain socket.
+Once the totals reaching carbon stop changing, the result reports how
+many of the counter increments and timer samples were lost on the way,
+along with the daemon's own receive and kernel drop counters.
+"""
+
+# standard
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+# local
+from bench.carbon import LineCarbon
+from gstatsd.client import BufferedStatsClient, StatsClient
+
+# constants
+INTERVAL = 1
+SETTLE = 3 * INTERVAL
+TIMEOUT = 60
+
+
+def free_port():
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+def start_daemon(port, carbon, workers, unix_path):
+    cmd = [sys.executable, '-m', 'gstatsd.service',
+           '-b', '127.0.0.1:%d' % port, '-s', '127.0.0.1:%d' % carbon.port,
+           '-f', str(INTERVAL), '-w', str(workers),
+           '--unix-socket', unix_path]
+    proc = subprocess.Popen(cmd)
+
+    # the daemon is ready once a probe metric makes it through a flush
+    probe = StatsClient(('127.0.0.1', port))
+    end = time.time() + TIMEOUT
+    while not carbon.get('stats_counts.bench.ready'):
+        if proc.poll() is not None or time.time() > end:
+            raise RuntimeError('gstatsd did not start: %r' % cmd)
+        probe.increment('bench.ready')
+        time.sleep(0.1)
+    return proc
+
+
+def generate(client, metrics, keys, rate):
+    "Send metrics at up to rate per second, returning the elapsed time."
+    counters = ['bench.counter.%d' % i for i in xrange(keys)]
+    timers = ['bench.timer.%d' % i for i in xrange(keys)]
+    start = time.time()
+    for i in xrange(metrics):
+        if i & 1:
+            client.timer(timers[(i >> 1) % keys], i % 1000)
+        else:
+            client.increment(counters[(i >> 1) % keys])
+        if rate and not i % 100:
+            ahead = start + float(i) / rate - time.time()
+            if ahead > 0:
+                time.sleep(ahead)
+    if isinstance(client, BufferedStatsClient):
+        client.flush()
+    return time.time() - start
+
+
+def settle(carbon, expected):
+    "Wait for the counter total to reach expected or stop changing."
+    end = time.time() + TIMEOUT
+    while time.time() < end:
+        if carbon.total('stats_counts.bench.counter.') >= expected:
+            # give the timers, flushed with the same interval, a moment
+            time.sleep(0.1)
+            return
+        if time.time() - carbon.updated > SETTLE:
+            return
+        time.sleep(0.1)
+
+
+def measure(client_class, unix, metrics, keys, rate, workers):
+    carbon = LineCarbon()
+    port = free_port()
+    tmp = tempfile.mkdtemp()
+    unix_path = os.path.join(tmp, 'gstatsd.sock')
+    proc = start_daemon(port, carbon, workers, unix_path)
+    try:
+        addr = unix_path if unix else ('127.0.0.1', port)
+        elapsed = generate(client_class(addr), metrics, keys, rate)
+        sent_counts = (metrics + 1) // 2
+        sent_timers = metrics // 2
+        settle(carbon, sent_counts)
+        counts = carbon.total('stats_counts.bench.counter.')
+        timers = carbon.total('stats.timers.bench.timer.', '.count')
+        return {
+            'send_seconds': elapsed,
+            'offered_rate': metrics / elapsed,
+            'counter_loss': 1 - counts / sent_counts,
+            'timer_loss': 1 - timers / sent_timers if sent_timers else 0.0,
+            'recv_datagrams': carbon.total('statsd.recvDatagrams'),
+            'recv_metrics': carbon.total('statsd.recvMetrics'),
+            'udp_drops': carbon.total('statsd.udpDrops'),
+            'complete': counts == sent_counts and timers == sent_timers,
+            }
+    finally:
+        proc.terminate()
+        proc.wait()
+        carbon.stop()
+        shutil.rmtree(tmp)
+
+
+def main():
+    args = [int(arg) for arg in sys.argv[1:]]
+    workload = args + [200000, 1000, 0, 1][len(args):]
+    result = {'workload': dict(zip(('metrics', 'keys', 'rate', 'workers'),
+                                   workload))}
+    result['plain'] = measure(StatsClient, False, *workload)
+    result['buffered'] = measure(BufferedStatsClient, False, *workload)
+    result['unix'] = measure(StatsClient, True, *workload)
+    print json.dumps(result, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+"""
+Measure GraphiteSink.send across a grid of timer key counts and samples
+per key.
+
+    python -m bench.flush [keys,keys,...] [samples,samples,...]
+
+For every combination, 'send_seconds' is the wall time of the send() call
+the flush loop makes, which summarizes and formats the interval and hands
+it to the host sender, and 'deliver_seconds' is the time until a local
+fake carbon listener has received all of it.  'points_per_second' is the
+number of datapoints written divided by the send time.
+"""
+
+# standard
+import json
+import random
+import sys
+import time
+
+# local
+from bench.carbon import FakeCarbon
+from gstatsd import service, sink
+
+
+def make_stats(keys, samples):
+    rnd = random.Random(0)
+    stats = service.Stats()
+    for i in xrange(keys):
+        stats.timers['app.timer.%d' % i].extend(
+            rnd.uniform(0, 1000) for j in xrange(samples))
+    return stats
+
+
+def measure(keys, samples, repeat=3):
+    stats = make_stats(keys, samples)
+    size = len(sink.GraphiteSink().format(stats, int(time.time())))
+    best = None
+    for i in xrange(repeat):
+        carbon = FakeCarbon()
+        graphite = sink.GraphiteSink()
+        graphite.add('127.0.0.1:%d' % carbon.port)
+        start = time.time()
+        graphite.send(stats)
+        sent = time.time()
+        carbon.wait(size)
+        done = time.time()
+        carbon.server.stop()
+        if best is None or sent - start < best[0]:
+            best = (sent - start, done - start, carbon.received)
+    send, deliver, received = best
+    points = sum(1 for _ in sink.datapoints(stats))
+    return {
+        'send_seconds': send,
+        'deliver_seconds': deliver,
+        'points': points,
+        'points_per_second': points / send,
+        'wire_bytes': received,
+        }
+
+
+def main():
+    args = [[int(val) for val in arg.split(',')] for arg in sys.argv[1:]]
+    keys, samples = args + [[100, 1000, 10000], [1, 10, 100]][len(args):]
+    result = {'workload': {'keys': keys, 'samples_per_key': samples}}
+    for num in keys:
+        for count in samples:
+            result['%d_keys_%d_samples' % (num, count)] = measure(num, count)
+    print json.dumps(result, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
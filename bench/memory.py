@@ -0,0 +1,85 @@
+"""
+Compare the memory held by one interval of Stats in the default and the
+compact (-c) representation.
+
+    python -m bench.memory [samples] [timer keys] [counter keys] [gauge keys]
+
+The default workload is a 10 second interval at 200k samples/s: 2M timer
+samples spread over 1000 keys, plus 5000 counters and 1000 gauges.  The
+'compact_steady' figures are for a later interval, whose counters and
+gauges reuse the slot index built by the first one.
+"""
+
+# standard
+import json
+import random
+import sys
+
+# local
+from gstatsd import service
+
+
+def sizeof(obj, seen=None):
+    "Approximate deep size of obj in bytes, counting shared objects once."
+    if seen is None:
+        seen = set()
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        for key, val in obj.iteritems():
+            size += sizeof(key, seen) + sizeof(val, seen)
+    elif isinstance(obj, (list, tuple, set)):
+        for val in obj:
+            size += sizeof(val, seen)
+    elif isinstance(obj, service.SlotTable):
+        size += sizeof(obj._slots, seen) + sizeof(obj._values, seen)
+    return size
+
+
+def fill(stats, samples, timer_keys, counter_keys, gauge_keys):
+    rnd = random.Random(0)
+    timers = ['timer.%d' % i for i in xrange(timer_keys)]
+    for i in xrange(samples):
+        stats.timers[timers[i % timer_keys]].append(rnd.uniform(0, 1000))
+    for i in xrange(counter_keys):
+        stats.counts['counter.%d' % i] += 1.0
+    for i in xrange(gauge_keys):
+        stats.gauges['gauge.%d' % i] = float(i)
+
+
+def measure(compact, steady, *workload):
+    stats = service.Stats(compact=compact)
+    fill(stats, *workload)
+    # keys are interned strings shared with the packets, so leave them out
+    seen = set(id(key) for table in (stats.timers, stats.counts, stats.gauges)
+               for key in table)
+    if steady:
+        seen.update((id(stats.counts._slots), id(stats.gauges._slots)))
+        stats = service.Stats(compact=compact, previous=stats)
+        fill(stats, *workload)
+    return {
+        'timers': sizeof(stats.timers, seen),
+        'counts': sizeof(stats.counts, set(seen)),
+        'gauges': sizeof(stats.gauges, set(seen)),
+        }
+
+
+def main():
+    args = [int(arg) for arg in sys.argv[1:]]
+    workload = args + [2000000, 1000, 5000, 1000][len(args):]
+    result = {'workload': dict(zip(('samples', 'timer_keys', 'counter_keys',
+                                    'gauge_keys'), workload))}
+    modes = (('default', False, False), ('compact', True, False),
+             ('compact_steady', True, True))
+    for name, compact, steady in modes:
+        sizes = measure(compact, steady, *workload)
+        sizes['total'] = sum(sizes.values())
+        sizes['bytes_per_sample'] = float(sizes['timers']) / workload[0]
+        result[name] = sizes
+    print json.dumps(result, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
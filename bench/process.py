@@ -0,0 +1,102 @@
+"""
+Measure StatsDaemon._process throughput in packets per second.
+
+    python -m bench.process [packets] [distinct keys]
+
+'mixes' reports the throughput of the current hot path for several packet
+mixes: single metrics of one type, the realistic mixture the other figures
+use, multi-value packets, and the mixture aggregated into sketches.  The
+'locked' figure wraps every call in a gevent lock, which is what the
+receive loop paid per metric before ingest and flush switched to a
+lock-free Stats swap; 'lockless' is the current hot path.
+"""
+
+# standard
+import json
+import random
+import sys
+import time
+
+# local
+from gstatsd import service
+
+# vendor
+from gevent.thread import allocate_lock as Lock
+
+
+# a mix of timers, counters, sampled counters and gauges
+MIXED = ['%s:%d|ms', '%s:%d|ms', '%s:%d|ms', '%s:%d|c', '%s:%d|c',
+         '%s:%d|c|@0.1', '%s:%d|g']
+
+MIXES = (
+    ('timers', ['%s:%d|ms'], service.TIMER_EXACT),
+    ('counters', ['%s:%d|c'], service.TIMER_EXACT),
+    ('sampled', ['%s:%d|c|@0.1'], service.TIMER_EXACT),
+    ('gauges', ['%s:%d|g'], service.TIMER_EXACT),
+    ('mixed', MIXED, service.TIMER_EXACT),
+    ('multi', ['%s:%d|ms:%d|ms:%d|ms'], service.TIMER_EXACT),
+    ('mixed_sketch', MIXED, service.TIMER_SKETCH),
+    )
+
+
+def make_packets(count, keys, formats=MIXED):
+    rnd = random.Random(0)
+    names = ['app%d.api.endpoint%d.latency' % (i % 7, i) for i in xrange(keys)]
+    packets = []
+    for i in xrange(count):
+        fmt = rnd.choice(formats)
+        vals = tuple(rnd.randint(1, 500) for j in xrange(fmt.count('%d')))
+        packets.append(fmt % ((rnd.choice(names),) + vals))
+    return packets
+
+
+def make_daemon(timer_mode=service.TIMER_EXACT):
+    return service.StatsDaemon(':8125', [':2003'], 10, 90, 0,
+                               timer_mode=timer_mode)
+
+
+def run_lockless(svc, packets):
+    process = svc._process
+    for pkt in packets:
+        process(pkt)
+
+
+def run_locked(svc, packets):
+    process = svc._process
+    lock = Lock()
+    for pkt in packets:
+        with lock:
+            process(pkt)
+
+
+def measure(func, packets, timer_mode=service.TIMER_EXACT, repeat=3):
+    best = None
+    for i in xrange(repeat):
+        svc = make_daemon(timer_mode)
+        start = time.time()
+        func(svc, packets)
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return len(packets) / best
+
+
+def main():
+    args = [int(arg) for arg in sys.argv[1:]]
+    count, keys = args + [200000, 2000][len(args):]
+    mixes = {}
+    for name, formats, timer_mode in MIXES:
+        mixes[name] = measure(run_lockless, make_packets(count, keys, formats),
+                              timer_mode)
+    packets = make_packets(count, keys)
+    result = {
+        'workload': {'packets': count, 'keys': keys},
+        'mixes': mixes,
+        'locked_pps': measure(run_locked, packets),
+        'lockless_pps': measure(run_lockless, packets),
+        }
+    result['speedup'] = result['lockless_pps'] / result['locked_pps']
+    print json.dumps(result, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+"""
+Compare the plaintext line and pickle Graphite protocols.
+
+    python -m bench.protocol [timer keys] [samples per key] [counter keys]
+
+Each sink flushes the same interval to a local fake carbon listener; the
+result reports the bytes the listener received and the CPU time spent
+formatting the flush.
+"""
+
+# standard
+import json
+import random
+import sys
+import time
+
+# local
+from bench.carbon import FakeCarbon
+from gstatsd import service, sink
+
+
+def make_stats(timer_keys, samples, counter_keys):
+    rnd = random.Random(0)
+    stats = service.Stats()
+    for i in xrange(timer_keys):
+        stats.timers['app.timer.%d' % i].extend(
+            rnd.uniform(0, 1000) for j in xrange(samples))
+    for i in xrange(counter_keys):
+        stats.counts['app.counter.%d' % i] += rnd.randint(1, 100)
+        stats.gauges['app.gauge.%d' % i] = rnd.uniform(0, 100)
+    return stats
+
+
+def measure(graphite, stats, repeat=3):
+    cpu = None
+    for i in xrange(repeat):
+        start = time.clock()
+        data = graphite.format(stats, int(time.time()))
+        elapsed = time.clock() - start
+        cpu = elapsed if cpu is None else min(cpu, elapsed)
+
+    carbon = FakeCarbon()
+    graphite.add('127.0.0.1:%d' % carbon.port)
+    graphite.send(stats)
+    carbon.wait(len(data))
+    carbon.server.stop()
+    return {'format_cpu_seconds': cpu, 'wire_bytes': carbon.received}
+
+
+def main():
+    args = [int(arg) for arg in sys.argv[1:]]
+    workload = args + [2000, 100, 10000][len(args):]
+    stats = make_stats(*workload)
+    result = {
+        'workload': dict(zip(('timer_keys', 'samples_per_key',
+                              'counter_keys'), workload)),
+        sink.LINE: measure(sink.GraphiteSink(), stats),
+        sink.PICKLE: measure(sink.GraphitePickleSink(), stats),
+        }
+    print json.dumps(result, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
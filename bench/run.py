@@ -0,0 +1,86 @@
+"""
+Run the benchmarks and collect their results into one JSON document, so
+runs can be stored and compared to track regressions.
+
+    python -m bench.run [-o FILE] [name[:arg:arg...] ...]
+
+Each benchmark runs in its own interpreter, so one does not inherit the
+heap or the gevent hub of another.  Colon-separated arguments after the
+name are passed to the benchmark, e.g.
+`python -m bench.run process:50000:500 flush:100,1000:1,10`.
+With no names, every benchmark runs with its default workload.
+"""
+
+# standard
+import json
+import optparse
+import platform
+import subprocess
+import sys
+import time
+
+# local
+from gstatsd.core import __version__
+
+# constants
+BENCHMARKS = ('process', 'memory', 'protocol', 'flush', 'e2e')
+
+
+def revision():
+    "The git revision of the tree, if there is one."
+    try:
+        proc = subprocess.Popen(['git', 'rev-parse', 'HEAD'],
+                                stdout=subprocess.PIPE,
+                                stderr=subprocess.PIPE)
+    except OSError:
+        return None
+    out = proc.communicate()[0].strip()
+    return out if proc.returncode == 0 else None
+
+
+def run(name, args):
+    cmd = [sys.executable, '-m', 'bench.' + name] + args
+    start = time.time()
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE)
+    out = proc.communicate()[0]
+    if proc.returncode:
+        raise RuntimeError('%s exited with status %d' % (name,
+                                                         proc.returncode))
+    result = json.loads(out)
+    result['elapsed_seconds'] = time.time() - start
+    return result
+
+
+def main():
+    opts = optparse.OptionParser(usage='%prog [-o FILE] [name[:args] ...]')
+    opts.add_option('-o', '--output', dest='output', default=None,
+        help="write the results to FILE instead of standard output")
+    (options, names) = opts.parse_args()
+    if not names:
+        names = BENCHMARKS
+
+    result = {
+        'version': __version__,
+        'revision': revision(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'time': int(time.time()),
+        'results': {},
+        }
+    for spec in names:
+        args = spec.split(':')
+        name = args.pop(0)
+        if name not in BENCHMARKS:
+            opts.error('unknown benchmark %r' % name)
+        result['results'][name] = run(name, args)
+
+    data = json.dumps(result, indent=2, sort_keys=True)
+    if options.output:
+        with open(options.output, 'w') as out:
+            out.write(data + '\n')
+    else:
+        print data
+
+
+if __name__ == '__main__':
+    main()
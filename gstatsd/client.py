@@ -3,8 +3,19 @@
 # standard
 import random
 import socket
+import threading
 import time
+from collections import deque
 
+# local
+from core import MAX_PACKET
+
+# constants
+PACKET_SIZE = 512
+FLUSH_INTERVAL = 1.0
+RESERVOIR = 32
+QUEUE_SIZE = 10000
+DRAIN_INTERVAL = 0.1
 
 E_NOSTART = 'you must call start() before stop(). ignoring.'
 
@@ -15,7 +26,13 @@ def _format_float(val):
 
 class StatsClient(object):
 
-    "Simple client to exercise the statsd server."
+    """
+    Simple client to exercise the statsd server.
+
+    hostport is a (host, port) tuple, or the path of the server's unix
+    domain socket (--unix-socket).  Sends to a unix socket block while the
+    server's queue is full, rather than being dropped.
+    """
 
     HOSTPORT = ('', 8125)
 
@@ -23,7 +40,9 @@ class StatsClient(object):
         if hostport is None:
             hostport = StatsClient.HOSTPORT
         self._hostport = hostport
-        self._sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._unix = isinstance(hostport, basestring)
+        family = socket.AF_UNIX if self._unix else socket.AF_INET
+        self._sock = socket.socket(family, socket.SOCK_DGRAM)
 
     def timer(self, key, timestamp, sample_rate=1):
         self._send('%s:%d|ms' % (key, round(timestamp)), sample_rate)
@@ -31,6 +50,10 @@ class StatsClient(object):
     def gauge(self, key, value, sample_rate=1):
         self._send('%s:%s|g' % (key, _format_float(value)), sample_rate)
 
+    def set(self, key, member, sample_rate=1):
+        "Count member towards the number of unique members of key."
+        self._send('%s:%s|s' % (key, member), sample_rate)
+
     def increment(self, key, sample_rate=1):
         return self.counter(key, 1, sample_rate)
 
@@ -51,7 +74,302 @@ class StatsClient(object):
         else:
             packet = data
         if packet:
+            self._write(packet)
+
+    def _write(self, packet):
+        try:
             self._sock.sendto(packet, self._hostport)
+        except socket.error:
+            # e.g. the server's unix socket is missing while it restarts
+            pass
+
+
+class BufferedStatsClient(StatsClient):
+
+    """
+    Client that packs several metrics into each datagram.
+
+    Metrics are joined with newlines, which the server splits apart, into
+    datagrams of at most max_size bytes (capped at the server's
+    MAX_PACKET).  The buffer is sent when the next metric would not fit,
+    on flush(), and flush_interval seconds after the first metric in it
+    was added, by a background thread started with the first metric, so
+    a lone metric is not held back.  Call close() before exiting.  UDP
+    sends go through a connected socket, so the address is resolved
+    once.  Thread-safe.
+    """
+
+    # subclasses that send from their own thread need no flush timer
+    _timed = True
+
+    def __init__(self, hostport=None, max_size=PACKET_SIZE,
+                 flush_interval=FLUSH_INTERVAL):
+        StatsClient.__init__(self, hostport)
+        if not self._unix:
+            # a unix socket may come and go with the server, so each send
+            # addresses it instead
+            self._sock.connect(self._hostport)
+        self._max_size = min(max_size, MAX_PACKET)
+        self._flush_interval = flush_interval
+        self._buf = []
+        self._size = 0
+        self._started = 0
+        self._buf_lock = threading.Lock()
+        self._due = threading.Condition(self._buf_lock)
+        self._closed = False
+        self._timer = None
+
+    def flush(self):
+        "Send any buffered metrics."
+        with self._buf_lock:
+            self._flush()
+
+    def close(self):
+        with self._buf_lock:
+            self._closed = True
+            self._due.notify()
+            self._flush()
+        if self._timer is not None:
+            self._timer.join()
+        self._sock.close()
+
+    def _flush(self):
+        if self._buf:
+            packet = '\n'.join(self._buf)
+            self._buf = []
+            self._size = 0
+            self._sendall(packet)
+
+    def _sendall(self, packet):
+        try:
+            if self._unix:
+                self._sock.sendto(packet, self._hostport)
+            else:
+                self._sock.send(packet)
+        except socket.error:
+            # e.g. ECONNREFUSED reported for an earlier datagram while the
+            # server is down; stats are best-effort, like unconnected sends.
+            pass
+
+    def _write(self, packet):
+        size = len(packet)
+        with self._buf_lock:
+            if self._buf and self._size + size + 1 > self._max_size:
+                self._flush()
+            if self._buf:
+                self._size += 1
+            else:
+                self._started = time.time()
+                if self._timed and self._flush_interval > 0:
+                    self._wake()
+            self._buf.append(packet)
+            self._size += size
+            if self._size >= self._max_size or \
+                    time.time() - self._started >= self._flush_interval:
+                self._flush()
+
+    def _wake(self):
+        "Have the timer thread send the buffer once it is due."
+        if self._timer is None:
+            self._timer = threading.Thread(target=self._run_timer)
+            self._timer.daemon = True
+            self._timer.start()
+        else:
+            self._due.notify()
+
+    def _run_timer(self):
+        with self._buf_lock:
+            while not self._closed:
+                if not self._buf:
+                    self._due.wait()
+                    continue
+                remaining = self._started + self._flush_interval - time.time()
+                if remaining > 0:
+                    self._due.wait(remaining)
+                    continue
+                try:
+                    self._flush()
+                except Exception:
+                    pass
+
+
+class AggregatingStatsClient(BufferedStatsClient):
+
+    """
+    Client that aggregates metrics in memory and sends one line per key
+    every interval seconds, from a background thread.
+
+    Counters are summed, gauges keep their last value and set members are
+    sent once per interval.  Timers keep a
+    reservoir sample of at most `reservoir` values per key; once a key has
+    seen more values than that, its line carries the sample rate, which
+    the server uses to weight the timer's count so it still reflects every
+    call.  Since every call is aggregated, counter and gauge sample rates
+    are ignored.
+    Thread-safe; call close() to send what is left and stop the thread.
+    With interval=None nothing is sent until flush() is called.
+    """
+
+    _timed = False
+
+    def __init__(self, hostport=None, interval=FLUSH_INTERVAL,
+                 reservoir=RESERVOIR, max_size=PACKET_SIZE):
+        BufferedStatsClient.__init__(self, hostport, max_size)
+        self._reservoir = reservoir
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._counts = {}
+        self._gauges = {}
+        self._timers = {}
+        self._sets = {}
+        self._stopped = threading.Event()
+        self._thread = None
+        if interval:
+            self._thread = threading.Thread(target=self._run, args=(interval,))
+            self._thread.daemon = True
+            self._thread.start()
+
+    def timer(self, key, timestamp, sample_rate=1):
+        with self._lock:
+            entry = self._timers.get(key)
+            if entry is None:
+                self._timers[key] = [1, [timestamp]]
+                return
+            entry[0] += 1
+            samples = entry[1]
+            if len(samples) < self._reservoir:
+                samples.append(timestamp)
+            else:
+                idx = int(random.random() * entry[0])
+                if idx < self._reservoir:
+                    samples[idx] = timestamp
+
+    def gauge(self, key, value, sample_rate=1):
+        with self._lock:
+            self._gauges[key] = value
+
+    def set(self, key, member, sample_rate=1):
+        with self._lock:
+            members = self._sets.get(key)
+            if members is None:
+                members = self._sets[key] = set()
+            members.add(member)
+
+    def counter(self, keys, magnitude=1, sample_rate=1):
+        if not isinstance(keys, (list, tuple)):
+            keys = [keys]
+        with self._lock:
+            counts = self._counts
+            for key in keys:
+                counts[key] = counts.get(key, 0) + magnitude
+
+    def flush(self):
+        "Send the aggregates collected since the last flush."
+        with self._lock:
+            counts, self._counts = self._counts, {}
+            gauges, self._gauges = self._gauges, {}
+            timers, self._timers = self._timers, {}
+            sets, self._sets = self._sets, {}
+        with self._flush_lock:
+            for key, val in counts.iteritems():
+                self._write('%s:%s|c' % (key, _format_float(val)))
+            for key, val in gauges.iteritems():
+                self._write('%s:%s|g' % (key, _format_float(val)))
+            for key, (seen, samples) in timers.iteritems():
+                self._write_timer(key, seen, samples)
+            for key, members in sets.iteritems():
+                for member in members:
+                    self._write('%s:%s|s' % (key, member))
+            BufferedStatsClient.flush(self)
+
+    def close(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.flush()
+        BufferedStatsClient.close(self)
+
+    def _write_timer(self, key, seen, samples):
+        "Write the samples as few multi-value lines as max_size allows."
+        suffix = '|ms'
+        if seen > len(samples):
+            # repr keeps every digit; tiny rates must not round to 0
+            suffix += '|@%r' % (float(len(samples)) / seen)
+        line = [key]
+        size = len(key)
+        for val in samples:
+            field = '%d%s' % (round(val), suffix)
+            if len(line) > 1 and size + len(field) + 1 > self._max_size:
+                self._write(':'.join(line))
+                line = [key]
+                size = len(key)
+            line.append(field)
+            size += len(field) + 1
+        self._write(':'.join(line))
+
+    def _run(self, interval):
+        while not self._stopped.wait(interval):
+            try:
+                self.flush()
+            except Exception:
+                pass
+
+
+class QueuedStatsClient(BufferedStatsClient):
+
+    """
+    Client whose metric calls never touch the socket.
+
+    Each call formats its metric and appends it to a bounded queue; a
+    background thread drains the queue every drain_interval seconds,
+    applies the sample rates and sends the metrics in batched datagrams.
+    When the queue already holds queue_size metrics new ones are dropped
+    and counted in `dropped`.  Call close() to send what is queued and
+    stop the thread.
+    """
+
+    _timed = False
+
+    def __init__(self, hostport=None, queue_size=QUEUE_SIZE,
+                 drain_interval=DRAIN_INTERVAL, max_size=PACKET_SIZE):
+        BufferedStatsClient.__init__(self, hostport, max_size)
+        self.dropped = 0
+        self._queue_size = queue_size
+        self._queue = deque()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run,
+                                        args=(drain_interval,))
+        self._thread.daemon = True
+        self._thread.start()
+
+    def close(self):
+        self._stopped.set()
+        self._thread.join()
+        self._drain()
+        BufferedStatsClient.close(self)
+
+    def _send(self, data, sample_rate=1):
+        # deque appends are atomic, so callers never wait on a lock
+        if len(self._queue) >= self._queue_size:
+            self.dropped += 1
+        else:
+            self._queue.append((data, sample_rate))
+
+    def _drain(self):
+        "Send everything queued so far."
+        queue = self._queue
+        send = BufferedStatsClient._send
+        while queue:
+            data, sample_rate = queue.popleft()
+            send(self, data, sample_rate)
+        self.flush()
+
+    def _run(self, interval):
+        while not self._stopped.wait(interval):
+            try:
+                self._drain()
+            except Exception:
+                pass
 
 
 class StatsCounter(object):
@@ -1,5 +1,10 @@
 
 # standard
+import os
+import shutil
+import socket
+import tempfile
+import time
 import unittest
 
 # local
@@ -61,6 +66,12 @@ class StatsClientTest(unittest.TestCase):
         self._cli.gauge('foo', 5.9)
         self.assertEquals(self._cli.packets[-1], ('foo:5.9|g', 1))
 
+    def test_set(self):
+        self._cli.set('users', 'alice')
+        self.assertEquals(self._cli.packets[-1], ('users:alice|s', 1))
+        self._cli.set('ids', 42)
+        self.assertEquals(self._cli.packets[-1], ('ids:42|s', 1))
+
 
 class StatsTest(unittest.TestCase):
 
@@ -88,6 +99,194 @@ class StatsTest(unittest.TestCase):
         self.assertEquals(self._cli.packets[-1], ('foo:5|c', 1))
 
 
+class UnixSocketTest(unittest.TestCase):
+
+    def setUp(self):
+        self._dir = tempfile.mkdtemp()
+        self._path = os.path.join(self._dir, 'gstatsd.sock')
+        self._server = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self._server.bind(self._path)
+        self._server.settimeout(1)
+
+    def tearDown(self):
+        self._server.close()
+        shutil.rmtree(self._dir)
+
+    def test_send(self):
+        cli = client.StatsClient(self._path)
+        cli.increment('foo')
+        self.assertEquals(self._server.recv(4096), 'foo:1|c')
+        cli = client.BufferedStatsClient(self._path)
+        cli.increment('foo')
+        cli.timer('bar', 5)
+        cli.flush()
+        self.assertEquals(self._server.recv(4096), 'foo:1|c\nbar:5|ms')
+        cli.close()
+
+    def test_missing(self):
+        # sends are best-effort while the server is away
+        os.unlink(self._path)
+        client.StatsClient(self._path).increment('foo')
+        cli = client.BufferedStatsClient(self._path)
+        cli.increment('foo')
+        cli.close()
+
+
+class BufferedStatsClientTest(unittest.TestCase):
+
+    def setUp(self):
+        self._server = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._server.bind(('127.0.0.1', 0))
+        self._server.settimeout(1)
+        self._cli = client.BufferedStatsClient(self._server.getsockname(),
+                                               max_size=32)
+
+    def tearDown(self):
+        self._cli.close()
+        self._server.close()
+
+    def _recv(self):
+        return self._server.recv(4096)
+
+    def test_batching(self):
+        self._cli.increment('foo')
+        self._cli.timer('bar', 15)
+        self._cli.flush()
+        self.assertEquals(self._recv(), 'foo:1|c\nbar:15|ms')
+
+    def test_max_size(self):
+        for i in range(5):
+            self._cli.increment('key%d' % i)
+        # each metric is 8 bytes plus a newline, so three fit in 32 bytes
+        self.assertEquals(self._recv(), 'key0:1|c\nkey1:1|c\nkey2:1|c')
+        self._cli.flush()
+        self.assertEquals(self._recv(), 'key3:1|c\nkey4:1|c')
+
+    def test_flush_interval(self):
+        cli = client.BufferedStatsClient(self._server.getsockname(),
+                                         flush_interval=0)
+        cli.increment('foo')
+        self.assertEquals(self._recv(), 'foo:1|c')
+        cli.close()
+
+    def test_timed_flush(self):
+        cli = client.BufferedStatsClient(self._server.getsockname(),
+                                         flush_interval=0.05)
+        start = time.time()
+        cli.increment('foo')
+        # a lone metric goes out once the interval is up
+        self.assertEquals(self._recv(), 'foo:1|c')
+        self.assertTrue(0.05 <= time.time() - start < 0.5)
+        cli.increment('bar')
+        self.assertEquals(self._recv(), 'bar:1|c')
+        cli.close()
+
+    def test_capped(self):
+        cli = client.BufferedStatsClient(self._server.getsockname(),
+                                         max_size=100000)
+        self.assertEquals(cli._max_size, client.MAX_PACKET)
+        cli.close()
+
+
+class AggregatingStatsClientTest(unittest.TestCase):
+
+    def setUp(self):
+        self._server = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._server.bind(('127.0.0.1', 0))
+        self._server.settimeout(1)
+        self._cli = client.AggregatingStatsClient(self._server.getsockname(),
+                                                  interval=None, reservoir=4)
+
+    def tearDown(self):
+        self._cli.close()
+        self._server.close()
+
+    def _lines(self):
+        self._cli.flush()
+        return sorted(self._server.recv(4096).split('\n'))
+
+    def test_aggregate(self):
+        for i in range(100):
+            self._cli.increment('foo')
+            self._cli.gauge('bar', i)
+        self._cli.decrement('foo')
+        self._cli.counter(['foo', 'baz'], 2.5)
+        self._cli.timer('t', 15)
+        self._cli.timer('t', 20.2)
+        self.assertEquals(self._lines(), ['bar:99|g', 'baz:2.5|c',
+                                          'foo:101.5|c', 't:15|ms:20|ms'])
+        self._cli.increment('foo')
+        self.assertEquals(self._lines(), ['foo:1|c'])
+
+    def test_set(self):
+        for member in ('a', 'b', 'a', 'c', 'b'):
+            self._cli.set('users', member)
+        self.assertEquals(self._lines(), ['users:a|s', 'users:b|s',
+                                          'users:c|s'])
+
+    def test_reservoir(self):
+        for i in range(100):
+            self._cli.timer('t', i)
+        line, = self._lines()
+        fields = line.split(':')
+        self.assertEquals(fields[0], 't')
+        self.assertEquals(len(fields), 5)
+        for field in fields[1:]:
+            self.assertTrue(field.endswith('|ms|@0.04'))
+
+    def test_reservoir_rate(self):
+        # a rate too small for six decimals is sent in full
+        self._cli._write_timer('t', 3000000, [1.0] * 32)
+        line = self._lines()[0]
+        rate = float(line.rsplit('@', 1)[1])
+        self.assertEquals(rate, 32.0 / 3000000)
+
+    def test_background(self):
+        cli = client.AggregatingStatsClient(self._server.getsockname(),
+                                            interval=0.05)
+        cli.increment('foo')
+        self.assertEquals(self._server.recv(4096), 'foo:1|c')
+        cli.close()
+
+    def test_close(self):
+        cli = client.AggregatingStatsClient(self._server.getsockname(),
+                                            interval=60)
+        cli.increment('foo')
+        cli.increment('foo')
+        cli.gauge('g', 3)
+        cli.close()
+        self.assertEquals(sorted(self._server.recv(4096).split('\n')),
+                          ['foo:2|c', 'g:3|g'])
+
+
+class QueuedStatsClientTest(unittest.TestCase):
+
+    def setUp(self):
+        self._server = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._server.bind(('127.0.0.1', 0))
+        self._server.settimeout(1)
+
+    def tearDown(self):
+        self._server.close()
+
+    def test_background(self):
+        cli = client.QueuedStatsClient(self._server.getsockname(),
+                                       drain_interval=0.01)
+        cli.increment('foo')
+        cli.timer('bar', 15)
+        self.assertEquals(self._server.recv(4096), 'foo:1|c\nbar:15|ms')
+        cli.close()
+
+    def test_overflow(self):
+        cli = client.QueuedStatsClient(self._server.getsockname(),
+                                       queue_size=2, drain_interval=60)
+        for i in range(5):
+            cli.increment('key%d' % i)
+        self.assertEquals(cli.dropped, 3)
+        cli.close()
+        self.assertEquals(self._server.recv(4096), 'key0:1|c\nkey1:1|c')
+
+
 def main():
     unittest.main()
 
@@ -0,0 +1,176 @@
+
+# standard
+import struct
+import sys
+import zlib
+from array import array
+
+# local
+from hll import UniqueSet
+from sketch import TimerSketch
+
+# constants
+MAGIC = 'GSD1'
+COMPRESSION = 1
+FRAME_HEADER = struct.Struct('!I')
+
+# value kinds of timers and sets
+EXACT = 0
+SKETCH = 1
+
+_COUNT = struct.Struct('<I')
+_KEY = struct.Struct('<H')
+_KIND = struct.Struct('<B')
+_DOUBLE = struct.Struct('<d')
+_SUMMARY = struct.Struct('<Qdddd')
+_BUCKET = struct.Struct('<iQ')
+_BIG_ENDIAN = sys.byteorder == 'big'
+
+E_BADMAGIC = 'not a forwarded interval (magic %r)'
+
+
+def frame(data):
+    "Prefix data with its length, as read by service.recv_frame."
+    return FRAME_HEADER.pack(len(data)) + data
+
+
+def _doubles(vals):
+    vals = array('d', vals)
+    if _BIG_ENDIAN:
+        vals.byteswap()
+    return vals.tostring()
+
+
+def encode(stats, source=''):
+    """
+    Serialize an interval's aggregates for forwarding to an upstream
+    daemon: counter sums, gauge values, timer samples or sketches and the
+    weights of sampled timers, sets and the daemon's own metrics, tagged
+    with the name of the source.  Keys are length-prefixed, numbers are
+    little-endian binary and the whole is zlib-compressed, since keys
+    share long prefixes.
+    """
+    out = [MAGIC, _KEY.pack(len(source)), source,
+           _DOUBLE.pack(stats.interval)]
+
+    def put_key(key):
+        out.append(_KEY.pack(len(key)))
+        out.append(key)
+
+    for table in (stats.counts, stats.gauges, stats.internal,
+                  stats.timer_weights):
+        items = list(table.iteritems())
+        out.append(_COUNT.pack(len(items)))
+        for key, val in items:
+            put_key(key)
+            out.append(_DOUBLE.pack(val))
+
+    timers = [(key, vals) for key, vals in stats.timers.iteritems() if vals]
+    out.append(_COUNT.pack(len(timers)))
+    for key, vals in timers:
+        put_key(key)
+        if isinstance(vals, TimerSketch):
+            count, total, sumsq, vmin, vmax, buckets = vals.__getstate__()
+            out.append(_KIND.pack(SKETCH))
+            out.append(_SUMMARY.pack(count, total, sumsq, vmin, vmax))
+            out.append(_COUNT.pack(len(buckets)))
+            out.extend(_BUCKET.pack(idx, num)
+                       for idx, num in buckets.iteritems())
+        else:
+            out.append(_KIND.pack(EXACT))
+            out.append(_COUNT.pack(len(vals)))
+            out.append(_doubles(vals))
+
+    out.append(_COUNT.pack(len(stats.sets)))
+    for key, uniq in stats.sets.iteritems():
+        put_key(key)
+        precision, members, registers = uniq.__getstate__()
+        if registers is None:
+            out.append(_KIND.pack(EXACT))
+            out.append(_KIND.pack(precision))
+            out.append(_COUNT.pack(len(members)))
+            for member in members:
+                put_key(member)
+        else:
+            out.append(_KIND.pack(SKETCH))
+            out.append(_KIND.pack(precision))
+            out.append(str(registers))
+    return zlib.compress(''.join(out), COMPRESSION)
+
+
+class _Reader(object):
+
+    def __init__(self, data):
+        self.data = data
+        self.pos = 0
+
+    def take(self, size):
+        pos = self.pos
+        self.pos = pos + size
+        if self.pos > len(self.data):
+            raise ValueError('truncated forwarded interval')
+        return self.data[pos:self.pos]
+
+    def unpack(self, fmt):
+        return fmt.unpack(self.take(fmt.size))
+
+    def count(self):
+        return self.unpack(_COUNT)[0]
+
+    def key(self):
+        return self.take(self.unpack(_KEY)[0])
+
+    def kind(self):
+        return self.unpack(_KIND)[0]
+
+
+def decode(data, stats):
+    """
+    Read an interval written by encode into the empty Stats given, for the
+    receiver to merge into its own, and return the name of its source.
+    """
+    reader = _Reader(zlib.decompress(data))
+    magic = reader.take(len(MAGIC))
+    if magic != MAGIC:
+        raise ValueError(E_BADMAGIC % magic)
+    source = reader.key()
+    stats.interval, = reader.unpack(_DOUBLE)
+
+    for table in (stats.counts, stats.gauges, stats.internal,
+                  stats.timer_weights):
+        for i in xrange(reader.count()):
+            key = intern(reader.key())
+            table[key], = reader.unpack(_DOUBLE)
+
+    timers = stats.timers
+    for i in xrange(reader.count()):
+        key = intern(reader.key())
+        if reader.kind() == SKETCH:
+            summary = reader.unpack(_SUMMARY)
+            buckets = dict(reader.unpack(_BUCKET)
+                           for j in xrange(reader.count()))
+            sketch = TimerSketch.__new__(TimerSketch)
+            sketch.__setstate__(summary + (buckets,))
+            timers[key] = sketch
+        else:
+            num = reader.count()
+            vals = array('d')
+            vals.fromstring(reader.take(num * 8))
+            if _BIG_ENDIAN:
+                vals.byteswap()
+            timers[key] = vals
+
+    sets = stats.sets
+    for i in xrange(reader.count()):
+        key = intern(reader.key())
+        kind = reader.kind()
+        precision = reader.kind()
+        uniq = UniqueSet(precision)
+        if kind == SKETCH:
+            registers = bytearray(reader.take(1 << precision))
+            uniq.__setstate__((precision, set(), registers))
+        else:
+            for j in xrange(reader.count()):
+                uniq.add(reader.key())
+        sets[key] = uniq
+    return source
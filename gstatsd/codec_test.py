@@ -0,0 +1,82 @@
+
+# standard
+import unittest
+import zlib
+
+# local
+from gstatsd import codec, service
+from gstatsd.sketch import TimerSketch
+
+
+class CodecTest(unittest.TestCase):
+
+    def _roundtrip(self, stats, source='web1'):
+        received = service.Stats()
+        self.assertEquals(codec.decode(codec.encode(stats, source), received),
+                          source)
+        return received
+
+    def test_roundtrip(self):
+        stats = service.Stats()
+        stats.interval = 5.0
+        stats.counts['c'] += 2.5
+        stats.gauges['g'] = -1.0
+        stats.timers['t'].extend([3.0, 1.0, 2.0])
+        stats.timers['empty']
+        stats.timer_weights['t'] += 9.0
+        stats.sets['s'].add('alice')
+        stats.sets['s'].add('bob')
+        stats.internal['recvMetrics'] = 7
+        received = self._roundtrip(stats)
+        self.assertEquals(received.interval, 5.0)
+        self.assertEquals(received.counts, {'c': 2.5})
+        self.assertEquals(received.gauges, {'g': -1.0})
+        self.assertEquals(dict((key, list(vals)) for key, vals
+                               in received.timers.iteritems()),
+                          {'t': [3.0, 1.0, 2.0]})
+        self.assertEquals(received.timer_weights, {'t': 9.0})
+        self.assertEquals(received.sets['s'].cardinality(), 2)
+        self.assertTrue(received.sets['s'].exact)
+        self.assertEquals(received.internal, {'recvMetrics': 7.0})
+
+    def test_sketches(self):
+        stats = service.Stats(service.TIMER_SKETCH, compact=True,
+                              set_precision=6)
+        stats.counts['c'] += 1
+        for i in range(1, 1001):
+            stats.timers['t'].append(float(i))
+            stats.sets['s'].add(str(i))
+        received = self._roundtrip(stats)
+        self.assertEquals(received.counts, {'c': 1.0})
+        timer = received.timers['t']
+        self.assertTrue(isinstance(timer, TimerSketch))
+        self.assertEquals(timer.__getstate__(),
+                          stats.timers['t'].__getstate__())
+        uniq = received.sets['s']
+        self.assertFalse(uniq.exact)
+        self.assertEquals(uniq.precision, 6)
+        self.assertEquals(uniq.cardinality(), stats.sets['s'].cardinality())
+
+    def test_compact(self):
+        # a thousand samples of one key cost a few bytes each, not a line
+        stats = service.Stats()
+        for i in range(1000):
+            stats.timers['app.request.latency'].append(float(i % 50))
+            stats.counts['app.requests.%d' % (i % 100)] += 1
+        data = codec.encode(stats)
+        self.assertTrue(len(data) < 4000)
+
+    def test_bad(self):
+        self.assertRaises(ValueError, codec.decode, zlib.compress('nope'),
+                          service.Stats())
+        data = zlib.compress(zlib.decompress(codec.encode(service.Stats()))
+                             [:-2])
+        self.assertRaises(ValueError, codec.decode, data, service.Stats())
+
+
+def main():
+    unittest.main()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,3 +1,5 @@
 
 __version__ = '0.6'
 
+# largest datagram the service reads
+MAX_PACKET = 2048
@@ -0,0 +1,64 @@
+
+# standard
+import bisect
+from hashlib import md5
+
+# constants
+REPLICA_COUNT = 100
+
+
+class ConsistentHashRing(object):
+
+    """
+    Consistent hash ring that places keys exactly like carbon-relay's
+    ConsistentHashRing, so a metric lands on the same carbon instance
+    whether it is routed here or by a relay.  Nodes are (server, instance)
+    tuples, instance being None unless one is configured.
+    """
+
+    def __init__(self, nodes=(), replica_count=REPLICA_COUNT):
+        self.ring = []
+        self.nodes = set()
+        self.replica_count = replica_count
+        for node in nodes:
+            self.add_node(node)
+
+    def compute_ring_position(self, key):
+        return int(md5(str(key)).hexdigest()[:4], 16)
+
+    def add_node(self, node):
+        self.nodes.add(node)
+        taken = set(position for position, _ in self.ring)
+        for i in xrange(self.replica_count):
+            replica_key = '%s:%d' % (node, i)
+            position = self.compute_ring_position(replica_key)
+            while position in taken:
+                position += 1
+            taken.add(position)
+            bisect.insort(self.ring, (position, node))
+
+    def get_node(self, key):
+        position = self.compute_ring_position(key)
+        index = bisect.bisect_left(self.ring, (position, None))
+        return self.ring[index % len(self.ring)][1]
+
+    def get_nodes(self, key, count, diverse=False):
+        """
+        Return up to count distinct nodes for key, in ring order.  With
+        diverse, nodes on a server already chosen are skipped, as
+        carbon-relay's getDestinations does under DIVERSE_REPLICAS.
+        """
+        nodes = []
+        servers = set()
+        size = len(self.ring)
+        position = self.compute_ring_position(key)
+        index = bisect.bisect_left(self.ring, (position, None)) % size
+        for i in xrange(size):
+            node = self.ring[(index + i) % size][1]
+            if node in nodes or (diverse and node[0] in servers):
+                continue
+            nodes.append(node)
+            servers.add(node[0])
+            if len(nodes) == count:
+                break
+        return nodes
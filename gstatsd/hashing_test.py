@@ -0,0 +1,52 @@
+
+# standard
+import unittest
+
+# local
+from gstatsd.hashing import ConsistentHashRing
+
+
+NODES = [('10.0.0.1', None), ('10.0.0.2', None), ('10.0.0.3', 'a'),
+         ('10.0.0.3', 'b')]
+
+
+class ConsistentHashRingTest(unittest.TestCase):
+
+    def setUp(self):
+        self.ring = ConsistentHashRing(NODES)
+
+    def test_carbon_compatible(self):
+        # expected placements were computed with carbon 1.1's hashing module
+        self.assertEquals(self.ring.get_node('stats.foo'), NODES[0])
+        self.assertEquals(self.ring.get_nodes('stats.foo', 2), NODES[:2])
+        self.assertEquals(self.ring.get_nodes('stats_counts.bar', 2),
+                          [NODES[2], NODES[0]])
+        self.assertEquals(self.ring.get_node('stats.timers.baz.mean'),
+                          NODES[2])
+
+    def test_ring(self):
+        self.assertEquals(len(self.ring.ring), 400)
+        positions = [position for position, _ in self.ring.ring]
+        self.assertEquals(len(set(positions)), 400)
+
+    def test_replicas(self):
+        nodes = self.ring.get_nodes('stats.foo', 10)
+        self.assertEquals(sorted(nodes), sorted(NODES))
+
+    def test_diverse_replicas(self):
+        # both instances on 10.0.0.3 come first in ring order; carbon-relay
+        # replicates to another server instead
+        self.assertEquals(self.ring.get_nodes('stats.k15', 2),
+                          [NODES[2], NODES[3]])
+        self.assertEquals(self.ring.get_nodes('stats.k15', 2, diverse=True),
+                          [NODES[2], NODES[1]])
+        nodes = self.ring.get_nodes('stats.k15', 10, diverse=True)
+        self.assertEquals(nodes, [NODES[2], NODES[1], NODES[0]])
+
+
+def main():
+    unittest.main()
+
+
+if __name__ == '__main__':
+    main()
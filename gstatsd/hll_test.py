@@ -0,0 +1,71 @@
+
+# standard
+import cPickle
+import unittest
+
+# local
+from gstatsd.hll import UniqueSet
+
+
+class UniqueSetTest(unittest.TestCase):
+
+    def test_exact(self):
+        uniq = UniqueSet(10)
+        for i in range(64):
+            uniq.add('user%d' % (i % 50))
+        self.assertTrue(uniq.exact)
+        self.assertEquals(uniq.cardinality(), 50)
+
+    def test_switch(self):
+        uniq = UniqueSet(10)
+        for i in range(65):
+            uniq.add('user%d' % i)
+        self.assertFalse(uniq.exact)
+        self.assertEquals(len(uniq._registers), 1024)
+        self.assertEquals(uniq._members, set())
+        # linear counting keeps small cardinalities close
+        self.assertTrue(abs(uniq.cardinality() - 65) <= 2)
+
+    def test_estimate(self):
+        uniq = UniqueSet(12)
+        for i in range(50000):
+            uniq.add('user%d' % i)
+            uniq.add('user%d' % (i // 2))
+        # 1.6% standard error; allow four of them
+        self.assertTrue(abs(uniq.cardinality() / 50000.0 - 1) < 0.065)
+
+    def test_merge(self):
+        one = UniqueSet(8)
+        two = UniqueSet(8)
+        for i in range(10):
+            one.add('a%d' % i)
+            two.add('a%d' % (i + 5))
+        one.merge(two)
+        self.assertTrue(one.exact)
+        self.assertEquals(one.cardinality(), 15)
+
+        big = UniqueSet(8)
+        for i in range(5000):
+            big.add('a%d' % i)
+        one.merge(big)
+        self.assertFalse(one.exact)
+        self.assertEquals(one._registers, big._registers)
+        two.merge(one)
+        self.assertEquals(two._registers, big._registers)
+        self.assertRaises(ValueError, UniqueSet(6).merge, big)
+
+    def test_pickle(self):
+        uniq = UniqueSet(8)
+        for i in range(100):
+            uniq.add('a%d' % i)
+        copy = cPickle.loads(cPickle.dumps(uniq, cPickle.HIGHEST_PROTOCOL))
+        self.assertEquals(copy.cardinality(), uniq.cardinality())
+        self.assertEquals(copy.precision, 8)
+
+
+def main():
+    unittest.main()
+
+
+if __name__ == '__main__':
+    main()
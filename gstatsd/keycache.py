@@ -0,0 +1,49 @@
+
+
+class KeyCache(object):
+
+    """
+    Bounded map of raw packet keys to their final, interned form.
+
+    Lookups try a young generation first and an old generation second; a
+    key found in the old generation is promoted.  When the young generation
+    fills up it becomes the old one and the previous old generation is
+    dropped, so keys unused for a whole generation are evicted.  This
+    approximates LRU while a hit costs a single dict lookup.
+    """
+
+    def __init__(self, size, transform):
+        self.size = size
+        self.hits = 0
+        self.misses = 0
+        self._transform = transform
+        self._limit = max(size // 2, 1)
+        self._young = {}
+        self._old = {}
+
+    def __len__(self):
+        return len(self._young) + len(self._old)
+
+    def get(self, raw):
+        "Return the final key for raw, computing and caching it on a miss."
+        key = self._young.get(raw)
+        if key is not None:
+            self.hits += 1
+            return key
+        key = self._old.pop(raw, None)
+        if key is None:
+            self.misses += 1
+            key = intern(self._transform(raw))
+        else:
+            self.hits += 1
+        if len(self._young) >= self._limit:
+            self._old = self._young
+            self._young = {}
+        self._young[raw] = key
+        return key
+
+    def reset_counters(self):
+        "Return (hits, misses) since the last call and zero them."
+        counters = (self.hits, self.misses)
+        self.hits = self.misses = 0
+        return counters
@@ -0,0 +1,49 @@
+
+# standard
+import unittest
+
+# local
+from gstatsd.keycache import KeyCache
+
+
+class KeyCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.calls = []
+        self.cache = KeyCache(4, self._transform)
+
+    def _transform(self, raw):
+        self.calls.append(raw)
+        return 'pfx.' + raw
+
+    def test_hits(self):
+        self.assertEquals(self.cache.get('foo'), 'pfx.foo')
+        self.assertEquals(self.cache.get('foo'), 'pfx.foo')
+        self.assertEquals(self.calls, ['foo'])
+        self.assertEquals(self.cache.reset_counters(), (1, 1))
+        self.assertEquals(self.cache.reset_counters(), (0, 0))
+
+    def test_interned(self):
+        one = self.cache.get('foo')
+        self.assertTrue(one is intern('pfx.foo'))
+
+    def test_bounded(self):
+        for i in range(100):
+            self.cache.get('key%d' % i)
+        self.assertTrue(len(self.cache) <= 4)
+
+    def test_promote(self):
+        # 'a' stays cached because it keeps being used
+        for key in ('a', 'b', 'a', 'c', 'a', 'd', 'a', 'e'):
+            self.cache.get(key)
+        self.assertEquals(self.calls.count('a'), 1)
+        self.cache.get('b')
+        self.assertEquals(self.calls.count('b'), 2)
+
+
+def main():
+    unittest.main()
+
+
+if __name__ == '__main__':
+    main()
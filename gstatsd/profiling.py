@@ -0,0 +1,132 @@
+
+# standard
+import os
+import signal
+import time
+from collections import defaultdict
+
+# local
+from sketch import TimerSketch
+
+# constants
+QUANTILES = (0.5, 0.9, 0.99)
+
+_MISSING = object()
+
+
+def _frame_name(frame):
+    code = frame.f_code
+    return '%s:%s' % (os.path.basename(code.co_filename), code.co_name)
+
+
+class Profiler(object):
+
+    """
+    Times the stages of the daemon for one profiling period.
+
+    wrap() replaces a method on an object with one that records the time
+    of every call, in microseconds, into the stage's TimerSketch, and
+    stop() puts the original back, so nothing is timed outside a profile.
+    With a sample interval the stack is also sampled every `sample`
+    seconds of cpu time, from SIGPROF, and counted as a folded stack, the
+    input of flamegraph.pl.
+    """
+
+    def __init__(self, sample=0.0):
+        self.sample = sample
+        self.started = time.time()
+        self.elapsed = 0.0
+        self.stages = {}
+        self.stacks = defaultdict(int)
+        self.active = True
+        self._wrapped = []
+        self._old_handler = None
+        if sample > 0:
+            self._old_handler = signal.signal(signal.SIGPROF, self._sample)
+            signal.siginterrupt(signal.SIGPROF, False)
+            signal.setitimer(signal.ITIMER_PROF, sample, sample)
+
+    def timed(self, stage, func):
+        "Wrap func so the duration of every call is added to stage."
+        hist = self.stages.get(stage)
+        if hist is None:
+            hist = self.stages[stage] = TimerSketch()
+        clock = time.time
+
+        def wrapper(*args):
+            started = clock()
+            try:
+                return func(*args)
+            finally:
+                hist.append((clock() - started) * 1e6)
+        return wrapper
+
+    def wrap(self, obj, name, stage=None):
+        "Time calls of obj's method name as stage, until stop is called."
+        self._wrapped.append((obj, name, obj.__dict__.get(name, _MISSING)))
+        setattr(obj, name, self.timed(stage or name, getattr(obj, name)))
+
+    def _sample(self, signum, frame):
+        names = []
+        while frame is not None:
+            # leave out the timing wrappers
+            if frame.f_globals.get('__name__') != __name__:
+                names.append(_frame_name(frame))
+            frame = frame.f_back
+        names.reverse()
+        self.stacks[';'.join(names)] += 1
+
+    def stop(self):
+        "Restore the wrapped methods and stop sampling."
+        for obj, name, saved in reversed(self._wrapped):
+            if saved is _MISSING:
+                delattr(obj, name)
+            else:
+                setattr(obj, name, saved)
+        self._wrapped = []
+        self.active = False
+        if self.sample > 0:
+            signal.setitimer(signal.ITIMER_PROF, 0, 0)
+            signal.signal(signal.SIGPROF, self._old_handler)
+        self.elapsed = time.time() - self.started
+
+    def report(self):
+        """
+        Return a table of the stages, one per line, with their number of
+        calls, total time as a share of the profile's wall time and
+        quantiles of the time per call.
+        """
+        elapsed = self.elapsed or time.time() - self.started
+        lines = ['# %.1fs profile, times in microseconds' % elapsed,
+                 '%-16s %10s %12s %7s %10s %10s %10s %10s' % (
+                     'stage', 'calls', 'total', 'share', 'p50', 'p90',
+                     'p99', 'max')]
+        for stage in sorted(self.stages):
+            hist = self.stages[stage]
+            if not hist.count:
+                continue
+            quantiles = tuple(hist.quantile(q) for q in QUANTILES)
+            lines.append('%-16s %10d %12.0f %6.1f%% %10.1f %10.1f %10.1f '
+                         '%10.1f' % ((stage, hist.count, hist.sum,
+                                      hist.sum / elapsed / 1e4)
+                                     + quantiles + (hist.max,)))
+        return '\n'.join(lines) + '\n'
+
+    def folded(self):
+        "Return the sampled stacks, one 'frame;frame;... count' per line."
+        return ''.join('%s %d\n' % item
+                       for item in sorted(self.stacks.iteritems()))
+
+    def dump(self, base):
+        """
+        Write the stage table to base.txt and, if the stack was sampled,
+        the folded stacks to base.folded.  Returns the paths written.
+        """
+        paths = [base + '.txt']
+        with open(paths[0], 'w') as fp:
+            fp.write(self.report())
+        if self.sample > 0:
+            paths.append(base + '.folded')
+            with open(paths[1], 'w') as fp:
+                fp.write(self.folded())
+        return paths
@@ -0,0 +1,87 @@
+
+# standard
+import os
+import shutil
+import signal
+import tempfile
+import time
+import unittest
+
+# local
+from gstatsd.profiling import Profiler
+
+
+class Worker(object):
+
+    def __init__(self):
+        self.step = self.step_default
+
+    def work(self, num):
+        return sum(xrange(num))
+
+    def step_default(self):
+        return 'default'
+
+
+class ProfilerTest(unittest.TestCase):
+
+    def test_wrap(self):
+        worker = Worker()
+        step = worker.step
+        profiler = Profiler()
+        profiler.wrap(worker, 'work')
+        profiler.wrap(worker, 'step', 'work')
+        self.assertEquals(worker.work(10), 45)
+        self.assertEquals(worker.step(), 'default')
+        self.assertEquals(profiler.stages['work'].count, 2)
+
+        # the originals are back once stopped
+        profiler.stop()
+        self.assertFalse('work' in worker.__dict__)
+        self.assertEquals(worker.step, step)
+        worker.work(10)
+        self.assertEquals(profiler.stages['work'].count, 2)
+
+    def test_report(self):
+        worker = Worker()
+        profiler = Profiler()
+        profiler.wrap(worker, 'work')
+        for i in range(100):
+            worker.work(1000)
+        profiler.stop()
+        lines = profiler.report().splitlines()
+        self.assertEquals(len(lines), 3)
+        self.assertEquals(lines[1].split()[0], 'stage')
+        fields = lines[2].split()
+        self.assertEquals(fields[:2], ['work', '100'])
+
+    def test_sample(self):
+        profiler = Profiler(0.001)
+        worker = Worker()
+        deadline = time.clock() + 0.2
+        while time.clock() < deadline:
+            worker.work(1000)
+        profiler.stop()
+        self.assertEquals(signal.getsignal(signal.SIGPROF), signal.SIG_DFL)
+        self.assertTrue(profiler.stacks)
+        self.assertTrue(any('profiling_test.py:test_sample' in stack
+                            for stack in profiler.stacks))
+
+        tmp = tempfile.mkdtemp()
+        try:
+            base = os.path.join(tmp, 'profile')
+            paths = profiler.dump(base)
+            self.assertEquals(paths, [base + '.txt', base + '.folded'])
+            with open(paths[1]) as fp:
+                stack, count = fp.readline().rsplit(' ', 1)
+            self.assertTrue(int(count) > 0)
+        finally:
+            shutil.rmtree(tmp)
+
+
+def main():
+    unittest.main()
+
+
+if __name__ == '__main__':
+    main()
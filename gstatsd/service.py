@@ -1,31 +1,77 @@
 
 # standard
+import cPickle
 import cStringIO
+import errno
+import math
 import optparse
 import os
 import resource
 import signal
+import stat
 import string
 import sys
+import tempfile
 import time
 import traceback
+import zlib
+from array import array
 from collections import defaultdict
+from functools import partial
 
 # local
+import codec
+import hll
 import sink
-from core import __version__
+from codec import FRAME_HEADER
+from core import __version__, MAX_PACKET
+from keycache import KeyCache
+from profiling import Profiler
+from sketch import TimerSketch
+from topk import SpaceSaving
 
 # vendor
 import gevent, gevent.socket
+from gevent.server import StreamServer
+
+# gevent 1.5 renamed gevent.signal, which became a module, to signal_handler
+_signal_handler = getattr(gevent, 'signal_handler', None) or gevent.signal
 socket = gevent.socket
-# protect stats  
-from gevent.thread import allocate_lock as Lock
-stats_lock = Lock()
 
 # constants
 INTERVAL = 10.0
 PERCENT = 90.0
-MAX_PACKET = 2048
+BATCH = 64
+TCP_READ = 65536
+KEY_CACHE = 10000
+STATS_PREFIX = 'statsd'
+OVERFLOW = 'overflow'
+PREFIX_DEPTH = 1
+PROFILE_SECONDS = 10.0
+
+# methods timed while profiling, and their stage names
+PROFILE_STAGES = (
+    ('_drain', 'drain'),
+    ('_recv_batch', 'recv'),
+    ('_process_lines', 'parse'),
+    ('_process', 'packet'),
+    ('_key', 'key'),
+    ('_flush', 'flush'),
+)
+PROC_NET_UDP = ('/proc/net/udp', '/proc/net/udp6')
+NAN = float('nan')
+
+# python 2 does not export SO_REUSEPORT; this is its value on linux
+SO_REUSEPORT = getattr(socket, 'SO_REUSEPORT',
+                       15 if sys.platform.startswith('linux') else None)
+
+# timer storage modes
+TIMER_EXACT = 'exact'
+TIMER_SKETCH = 'sketch'
+TIMER_MODES = {
+    TIMER_EXACT: list,
+    TIMER_SKETCH: TimerSketch,
+    }
 
 DESCRIPTION = '''
 A statsd service in Python + gevent.
@@ -43,16 +89,257 @@ KEY_DELETIONS = ''.join(ALL_ASCII.difference(KEY_VALID + '/'))
 # error messages
 E_BADADDR = 'invalid bind address specified %r'
 E_NOSINKS = 'you must specify at least one stats sink'
+E_BADFLOATS = 'invalid list of numbers %r'
+E_BADMODE = 'invalid timer mode %r, expected one of: %s'
+E_BADPROTO = 'invalid graphite protocol %r'
+E_BADPRECISION = 'invalid set precision %r, expected %d to %d'
+E_NOREUSEPORT = 'SO_REUSEPORT is not supported, cannot run multiple workers'
+E_WORKER = 'failed to collect stats from worker %d: %s'
+E_WORKERSLOST = 'lost %d worker(s), shutting down'
+E_FLUSHSTOPPED = 'flush loop stopped unexpectedly'
+E_NOTSOCKET = 'refusing to replace %r, which is not a socket'
+E_NOSPOOLDIR = 'spool directory %r does not exist'
+E_CHECKPOINT = 'failed to save checkpoint %r: %s'
+E_RESTORE = 'failed to restore checkpoint %r: %s'
+E_RESTORED = 'restored checkpoint %r: %d keys in %.1fms'
+E_PROFILE = 'failed to write profile %r: %s'
+E_PROFILED = 'profile written to %s'
+E_RELAY = 'relay connection from %s failed: %s'
+E_TCPCONN = 'tcp connection from %s failed: %s'
+E_TCPDONE = 'tcp connection from %s closed: %d bytes, %d metrics in %.1fs ' \
+    '(%.0f metrics/s)'
+
+
+class SlotTable(object):
+
+    """
+    A key -> float mapping that stores its values unboxed in an array('d').
+
+    The key -> slot index is shared with the tables of later intervals, so
+    once a key has been seen each interval only costs 8 bytes per key and
+    no per-interval dict or float allocations.  Unset slots hold NaN.
+    """
+
+    __slots__ = ('_slots', '_values')
+
+    def __init__(self, slots=None):
+        if slots is None:
+            slots = {}
+        self._slots = slots
+        self._values = array('d', [NAN]) * len(slots)
+
+    def __getitem__(self, key):
+        idx = self._slots.get(key)
+        if idx is None or idx >= len(self._values):
+            return 0.0
+        val = self._values[idx]
+        return 0.0 if val != val else val
+
+    def __setitem__(self, key, val):
+        slots = self._slots
+        idx = slots.get(key)
+        if idx is None:
+            idx = slots[key] = len(slots)
+        values = self._values
+        if idx >= len(values):
+            values.extend(array('d', [NAN]) * (idx + 1 - len(values)))
+        values[idx] = val
+
+    def __contains__(self, key):
+        idx = self._slots.get(key)
+        return idx is not None and idx < len(self._values) and \
+            self._values[idx] == self._values[idx]
+
+    def __len__(self):
+        return sum(1 for val in self._values if val == val)
+
+    def __iter__(self):
+        return (key for key, _ in self.iteritems())
+
+    def iteritems(self):
+        values = self._values
+        size = len(values)
+        # items() copies, so later intervals may add keys to the shared
+        # slot index while this table is being flushed.
+        for key, idx in self._slots.items():
+            if idx < size:
+                val = values[idx]
+                if val == val:
+                    yield key, val
+
+    def slots(self, used):
+        """
+        Slot index to share with the next interval's table.  Once fewer than
+        half the slots were used this interval the index is started afresh,
+        so keys that stop arriving do not pin memory forever.
+        """
+        if used * 2 < len(self._slots):
+            return None
+        return self._slots
 
 
 class Stats(object):
 
-    def __init__(self):
-        self.timers = defaultdict(list)
-        self.counts = defaultdict(float)
-        self.gauges = defaultdict(float)
-        self.percent = PERCENT
+    def __init__(self, timer_mode=TIMER_EXACT, compact=False, previous=None,
+                 set_precision=hll.PRECISION):
+        self.sets = defaultdict(partial(hll.UniqueSet, set_precision))
+        if compact:
+            if timer_mode == TIMER_EXACT:
+                self.timers = defaultdict(partial(array, 'd'))
+            else:
+                self.timers = defaultdict(TIMER_MODES[timer_mode])
+            counts = gauges = None
+            if previous is not None:
+                counts = previous.counts.slots(len(previous.counts))
+                gauges = previous.gauges.slots(len(previous.gauges))
+            self.counts = SlotTable(counts)
+            self.gauges = SlotTable(gauges)
+        else:
+            self.timers = defaultdict(TIMER_MODES[timer_mode])
+            self.counts = defaultdict(float)
+            self.gauges = defaultdict(float)
+        # timer samples that stand for more than one, from sample rates
+        # below 1: key -> weighted count beyond the samples stored
+        self.timer_weights = defaultdict(float)
+        self.percents = [PERCENT]
+        self.bins = []
         self.interval = INTERVAL
+        self.stats_prefix = STATS_PREFIX
+        self.internal = {}
+
+        # self-instrumentation counters bumped on the hot path
+        self.recv_wakeups = 0
+        self.recv_datagrams = 0
+        self.recv_batch_max = 0
+        self.recv_bytes = 0
+        self.recv_metrics = 0
+        self.parse_errors = 0
+        self.key_hits = 0
+        self.key_misses = 0
+
+        # cardinality limits and heavy hitters, see StatsDaemon._admit
+        self.admitted = set()
+        self.prefix_keys = defaultdict(int)
+        self.overflowed = 0
+        self.top_keys = None
+        self.top_prefixes = None
+
+        # peer -> [bytes, metrics, reads] received over tcp
+        self.tcp = {}
+
+        # intervals merged from downstream daemons, and their own metrics
+        self.relay_intervals = 0
+        self.relay_bytes = 0
+        self.relayed = {}
+
+    def __getstate__(self):
+        "Pickle without the admission tables, which only the receiver uses."
+        state = self.__dict__.copy()
+        state['admitted'] = set()
+        state['prefix_keys'] = defaultdict(int)
+        return state
+
+    def merge(self, other):
+        """
+        Fold another interval's aggregates, e.g. a worker's, into this one:
+        counters are summed, gauges take the other's value, timer samples
+        are concatenated or their sketches merged and sets are unioned.
+        """
+        timers = self.timers
+        for key, vals in other.timers.iteritems():
+            mine = timers[key]
+            if isinstance(vals, TimerSketch) and \
+                    not isinstance(mine, TimerSketch):
+                sketch = TimerSketch()
+                sketch.extend(mine)
+                timers[key] = mine = sketch
+            if isinstance(vals, TimerSketch):
+                mine.merge(vals)
+            else:
+                mine.extend(vals)
+        timer_weights = self.timer_weights
+        for key, val in other.timer_weights.iteritems():
+            timer_weights[key] += val
+        counts = self.counts
+        for key, val in other.counts.iteritems():
+            counts[key] += val
+        gauges = self.gauges
+        for key, val in other.gauges.iteritems():
+            gauges[key] = val
+        sets = self.sets
+        for key, val in other.sets.iteritems():
+            sets[key].merge(val)
+        for peer, counters in other.tcp.iteritems():
+            mine = self.tcp.setdefault(peer, [0, 0, 0])
+            for i, val in enumerate(counters):
+                mine[i] += val
+        self.relay_intervals += other.relay_intervals
+        self.relay_bytes += other.relay_bytes
+        self.relayed.update(other.relayed)
+        self.recv_wakeups += other.recv_wakeups
+        self.recv_datagrams += other.recv_datagrams
+        self.recv_batch_max = max(self.recv_batch_max, other.recv_batch_max)
+        self.recv_bytes += other.recv_bytes
+        self.recv_metrics += other.recv_metrics
+        self.parse_errors += other.parse_errors
+        self.key_hits += other.key_hits
+        self.key_misses += other.key_misses
+        self.overflowed += other.overflowed
+        for name in ('top_keys', 'top_prefixes'):
+            top = getattr(other, name)
+            if top is None:
+                continue
+            if getattr(self, name) is None:
+                setattr(self, name, SpaceSaving(top.capacity))
+            getattr(self, name).merge(top)
+
+
+def udp_socket_stats(port, paths=PROC_NET_UDP):
+    """
+    Return (drops, rx_queue) summed over the kernel's UDP sockets bound to
+    port, read from /proc/net/udp*, or None where that is unavailable.
+    """
+    port = ':%04X' % port
+    drops = queued = 0
+    found = False
+    for path in paths:
+        try:
+            with open(path) as fp:
+                lines = fp.readlines()[1:]
+        except IOError:
+            continue
+        for line in lines:
+            fields = line.split()
+            if len(fields) < 13 or not fields[1].endswith(port):
+                continue
+            found = True
+            queued += int(fields[4].split(':')[1], 16)
+            drops += int(fields[12])
+    if not found:
+        return None
+    return drops, queued
+
+
+def send_frame(sock, data):
+    "Write a length-prefixed frame."
+    sock.sendall(FRAME_HEADER.pack(len(data)) + data)
+
+
+def recv_frame(sock):
+    "Read a length-prefixed frame written by send_frame."
+    size, = FRAME_HEADER.unpack(_recv_exactly(sock, FRAME_HEADER.size))
+    return _recv_exactly(sock, size)
+
+
+def _recv_exactly(sock, size):
+    chunks = []
+    while size:
+        chunk = sock.recv(min(size, 65536))
+        if not chunk:
+            raise EOFError('connection closed')
+        chunks.append(chunk)
+        size -= len(chunk)
+    return ''.join(chunks)
 
 
 def daemonize(umask=0027):
@@ -90,6 +377,15 @@ def parse_addr(text):
     return None, None, None
 
 
+def parse_floats(text):
+    "Parse a number, a list of numbers or a comma-separated string of them."
+    if isinstance(text, basestring):
+        text = [part for part in text.split(',') if part.strip()]
+    elif not isinstance(text, (list, tuple)):
+        text = [text]
+    return [float(val) for val in text]
+
+
 class StatsDaemon(object):
 
     """
@@ -97,11 +393,50 @@ class StatsDaemon(object):
     """
 
     def __init__(self, bindaddr, sinkspecs, interval, percent, debug=0,
-                 key_prefix=''):
+                 key_prefix='', timer_mode=TIMER_EXACT, bins=None,
+                 compact=False, batch=BATCH, rcvbuf=0, workers=1,
+                 key_cache=KEY_CACHE, retries=sink.RETRIES, timeout=None,
+                 queue_size=sink.QUEUE_SIZE, protocol=sink.LINE,
+                 pickle_batch=sink.PICKLE_BATCH, replicas=None,
+                 stats_prefix=STATS_PREFIX, max_keys=0, max_prefix_keys=0,
+                 prefix_depth=PREFIX_DEPTH, top_keys=0,
+                 set_precision=hll.PRECISION, tcp_bindaddr=None,
+                 unix_path=None, relay_bindaddr=None, spool_dir=None,
+                 spool_size=sink.SPOOL_SIZE, replay_rate=sink.REPLAY_RATE,
+                 checkpoint=None, profile=False,
+                 profile_seconds=PROFILE_SECONDS, profile_sample=0.0,
+                 profile_dir=None):
         _, host, port = parse_addr(bindaddr)
         if port is None:
             self.exit(E_BADADDR % bindaddr)
         self._bindaddr = (host, port)
+        self._tcp_addr = None
+        if tcp_bindaddr:
+            _, host, port = parse_addr(tcp_bindaddr)
+            if port is None:
+                self.exit(E_BADADDR % tcp_bindaddr)
+            self._tcp_addr = (host, port)
+        self._tcp_server = None
+        self._tcp_open = 0
+        self._unix_path = unix_path
+        self._unix_sock = None
+        self._relay_addr = None
+        if relay_bindaddr:
+            _, host, port = parse_addr(relay_bindaddr)
+            if port is None:
+                self.exit(E_BADADDR % relay_bindaddr)
+            self._relay_addr = (host, port)
+        self._relay_server = None
+        if timer_mode not in TIMER_MODES:
+            self.exit(E_BADMODE % (timer_mode, ', '.join(sorted(TIMER_MODES))))
+        self._timer_mode = timer_mode
+        if not hll.MIN_PRECISION <= set_precision <= hll.MAX_PRECISION:
+            self.exit(E_BADPRECISION % (set_precision, hll.MIN_PRECISION,
+                                        hll.MAX_PRECISION))
+        self._set_precision = set_precision
+        self._compact = compact
+        self._stats = None
+        self._spare = None
 
         # TODO: generalize to support more than one sink type.  currently
         # only the graphite backend is present, but we may want to write
@@ -110,7 +445,20 @@ class StatsDaemon(object):
         # construct the sink and add hosts to it
         if not sinkspecs:
             self.exit(E_NOSINKS)
-        self._sink = sink.GraphiteSink()
+        if protocol == sink.FORWARD:
+            self._sink = sink.ForwardSink(retries, timeout, queue_size)
+        elif protocol == sink.PICKLE:
+            self._sink = sink.GraphitePickleSink(retries, timeout, queue_size,
+                                                 replicas, pickle_batch)
+        elif protocol == sink.LINE:
+            self._sink = sink.GraphiteSink(retries, timeout, queue_size,
+                                           replicas)
+        else:
+            self.exit(E_BADPROTO % protocol)
+        if spool_dir:
+            if not os.path.isdir(spool_dir):
+                self.exit(E_NOSPOOLDIR % spool_dir)
+            self._sink.spool_to(spool_dir, spool_size, replay_rate)
         errors = []
         for spec in sinkspecs:
             try:
@@ -122,20 +470,96 @@ class StatsDaemon(object):
                 self.error(str(err))
             self.exit('exiting.')
 
-        self._percent = float(percent)
+        try:
+            self._percents = parse_floats(percent)
+        except ValueError:
+            self._percents = None
+        if not self._percents or not all(0 < p <= 100
+                                         for p in self._percents):
+            self.exit(E_BADFLOATS % (percent,))
+        try:
+            self._bins = sorted(parse_floats(bins or []))
+        except ValueError:
+            self.exit(E_BADFLOATS % (bins,))
         self._interval = float(interval)
         self._debug = debug
         self._sock = None
         self._flush_task = None
+        self._stopping = None
+        self._receivers = []
+        self._flushing = None
+        self._rotate = self._rotate_stats
+        self._checkpoint_path = checkpoint
+        self._profiler = None
+        self._profile_at_start = profile
+        self._profile_seconds = float(profile_seconds)
+        self._profile_sample = float(profile_sample) / 1000.0
+        self._profile_dir = profile_dir or tempfile.gettempdir()
         self._key_prefix = key_prefix
+        self._stats_prefix = stats_prefix
+        self._flush_duration = 0.0
+        self._udp_drops = None
+        self._key_cache = None
+        self._key = self._make_key
+        if key_cache > 0:
+            self._key_cache = KeyCache(int(key_cache), self._make_key)
+            self._key = self._key_cache.get
+        self._max_keys = int(max_keys)
+        self._max_prefix_keys = int(max_prefix_keys)
+        self._prefix_depth = max(int(prefix_depth), 1)
+        self._top_keys = int(top_keys)
+        self._overflow_key = intern(self._make_key(OVERFLOW))
+        if self._max_keys or self._max_prefix_keys or self._top_keys:
+            # admission control wraps the key lookup, so it costs nothing
+            # unless it is asked for
+            self._lookup = self._key
+            self._key = self._admit
+        self._batch = max(int(batch), 1)
+        self._rcvbuf = int(rcvbuf)
+        self._workers = max(int(workers), 1)
+        self._worker_pids = []
+        self._worker_ctrls = []
+        self._workers_lost = 0
+        if self._workers > 1 and SO_REUSEPORT is None:
+            self.exit(E_NOREUSEPORT)
 
         self._reset_stats()
 
+    def _new_stats(self, previous=None):
+        stats = Stats(self._timer_mode, self._compact, previous,
+                      self._set_precision)
+        stats.percents = self._percents
+        stats.bins = self._bins
+        stats.interval = self._interval
+        stats.stats_prefix = self._stats_prefix
+        if self._top_keys:
+            stats.top_keys = SpaceSaving(self._top_keys)
+            stats.top_prefixes = SpaceSaving(self._top_keys)
+        return stats
+
     def _reset_stats(self):
-        with stats_lock:
-            self._stats = Stats()
-            self._stats.percent = self._percent
-            self._stats.interval = self._interval
+        self._stats = self._new_stats(self._stats)
+        self._spare = self._new_stats(self._stats)
+
+    def _rotate_stats(self):
+        """
+        Swap the standby Stats in for the active one and return the latter.
+
+        Ingest and flush share no lock: _process reads self._stats once per
+        packet and never yields, so the single attribute store below is the
+        only coordination needed.  The standby buffer is built off the hot
+        path once the previous flush has finished.
+        """
+        stats = self._stats
+        spare = self._spare
+        if spare is None:
+            spare = self._new_stats(stats)
+        self._stats = spare
+        self._spare = None
+        if self._key_cache is not None:
+            stats.key_hits, stats.key_misses = \
+                self._key_cache.reset_counters()
+        return stats
 
     def exit(self, msg, code=1):
         self.error(msg)
@@ -146,44 +570,587 @@ class StatsDaemon(object):
 
     def start(self):
         "Start the service"
+        # bound before forking, so every worker reads the same socket
+        if self._unix_path:
+            self._bind_unix()
+
+        if self._workers > 1:
+            # each worker receives and aggregates on its own share of the
+            # port; this process only merges their stats and flushes them.
+            self._fork_workers()
+            self._rotate = self._collect_workers
+
+        # restored after forking, so the saved aggregates are counted once
+        if self._checkpoint_path:
+            self._restore()
+
         # register signals
-        gevent.signal(signal.SIGINT, self._shutdown)
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            _signal_handler(signum, self._shutdown)
+        _signal_handler(signal.SIGUSR1, self._profile)
+        if self._profile_at_start:
+            self._profile()
+
+        # the tcp listener feeds this process' stats, which are flushed
+        # along with the workers'
+        if self._tcp_addr is not None:
+            self._listen_tcp()
+        if self._relay_addr is not None:
+            self._listen_relay()
+
+        if self._workers == 1:
+            socks = [self._bind()]
+            if self._unix_sock is not None:
+                socks.append(self._unix_sock)
+            self._receivers = [gevent.spawn(self._serve, sock)
+                               for sock in socks]
 
         # spawn the flush trigger
-        def _flush_impl():
-            while 1:
-                gevent.sleep(self._stats.interval)
+        self._flush_task = gevent.spawn(self._flush_loop, self._rotate)
+        self._flush_task.join()
+        if self._stopping is None:
+            self.exit(E_FLUSHSTOPPED)
+        # the shutdown killed the flush loop; it exits once done
+        self._stopping.join()
+
+    def _next_flush(self, after):
+        "The first multiple of the flush interval later than after."
+        return (math.floor(after / self._interval) + 1) * self._interval
 
+    def _flush_loop(self, rotate):
+        """
+        Flush on every wall-clock multiple of the interval, so intervals
+        line up with graphite's buckets and do not drift with the time each
+        flush takes.  A boundary missed by an overrunning flush is skipped.
+        """
+        due = 0
+        while 1:
+            due = self._next_flush(max(time.time(), due))
+            gevent.sleep(max(due - time.time(), 0))
+
+            stats = None
+            started = time.time()
+            try:
                 # rotate stats
-                stats = self._stats
-                self._reset_stats()
+                stats = rotate()
+                self._instrument(stats)
+                self._report_top(stats)
 
                 # send the stats to the sink which in turn broadcasts
                 # the stats packet to one or more hosts.
-                try:
-                    self._sink.send(stats)
-                except Exception, ex:
-                    trace = traceback.format_tb(sys.exc_info()[-1])
-                    self.error(''.join(trace))
+                started = time.time()
+                self._flushing = stats
+                self._flush(stats, int(due))
+            except Exception, ex:
+                trace = traceback.format_tb(sys.exc_info()[-1])
+                self.error(''.join(trace) + str(ex))
+            self._flushing = None
+            self._flush_duration = time.time() - started
+
+            # a lost worker took its share of the port with it; exit for
+            # the supervisor to restart the daemon
+            if self._workers_lost:
+                self.error(E_WORKERSLOST % self._workers_lost)
+                self._shutdown(code=1)
+
+            # prepare the standby buffer for the next rotation
+            if stats is not None:
+                self._spare = self._new_stats(stats)
+
+    def _flush(self, stats, now):
+        """
+        Summarize and format stats in a thread from the hub's pool, so the
+        receive loop keeps draining the socket meanwhile, then queue the
+        result for sending.  The rotated stats are handed over as they are:
+        the receive loop only writes to the other buffer.
+        """
+        pool = gevent.get_hub().threadpool
+        payloads = pool.apply(self._sink.prepare, (stats, now))
+        self._sink.deliver(payloads, stats.interval)
+
+    def _instrument(self, stats):
+        """
+        Fill in the daemon's own metrics for the interval in stats, which
+        the sink reports under the stats prefix.  Send timings are those of
+        the previous flush, which has completed by now.
+        """
+        internal = stats.internal
+        internal['recvWakeups'] = stats.recv_wakeups
+        internal['recvDatagrams'] = stats.recv_datagrams
+        internal['recvBatchMax'] = stats.recv_batch_max
+        internal['recvBytes'] = stats.recv_bytes
+        internal['recvMetrics'] = stats.recv_metrics
+        internal['parseErrors'] = stats.parse_errors
+        internal['keyCacheHits'] = stats.key_hits
+        internal['keyCacheMisses'] = stats.key_misses
+        internal['timerKeys'] = len(stats.timers)
+        internal['counterKeys'] = len(stats.counts)
+        internal['gaugeKeys'] = len(stats.gauges)
+        internal['setKeys'] = len(stats.sets)
+        if self._relay_addr is not None:
+            internal['relayIntervals'] = stats.relay_intervals
+            internal['relayBytes'] = stats.relay_bytes
+            internal.update(stats.relayed)
+        if self._tcp_addr is not None:
+            internal['tcpConnections'] = self._tcp_open
+            for peer, (nbytes, metrics, reads) in stats.tcp.iteritems():
+                name = 'tcp.' + peer
+                internal[name + '.bytes'] = nbytes
+                internal[name + '.metrics'] = metrics
+                internal[name + '.reads'] = reads
+        internal['overflowMetrics'] = stats.overflowed
+        internal['flushDuration'] = self._flush_duration * 1000.0
+        for name, val in self._sink.host_stats():
+            internal[name] = val
+
+        udp = udp_socket_stats(self._bindaddr[1])
+        if udp is not None:
+            drops, queued = udp
+            if self._udp_drops is not None:
+                internal['udpDrops'] = max(drops - self._udp_drops, 0)
+            internal['udpQueued'] = queued
+            self._udp_drops = drops
 
-        self._flush_task = gevent.spawn(_flush_impl)
+    def _report_top(self, stats):
+        """
+        Log the heaviest keys and prefixes of the interval, when tracked.
+        Counts that are estimates are logged as a lower..upper range.
+        """
+        for name, top in (('keys', stats.top_keys),
+                          ('prefixes', stats.top_prefixes)):
+            if top is None:
+                continue
+            items = []
+            for key, count, error in top.top():
+                if error:
+                    items.append('%s=%d..%d' % (key, count - error, count))
+                else:
+                    items.append('%s=%d' % (key, count))
+            self.error('top %s of %d: %s' % (name, top.total, ' '.join(items)))
 
-        # start accepting connections
-        self._sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM,
+    def _bind(self, reuse_port=False):
+        "Create the non-blocking UDP socket for the receive loop."
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM,
             socket.IPPROTO_UDP)
-        self._sock.bind(self._bindaddr)
+        if reuse_port:
+            sock.setsockopt(socket.SOL_SOCKET, SO_REUSEPORT, 1)
+        if self._rcvbuf:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, self._rcvbuf)
+        sock.bind(self._bindaddr)
+        sock.settimeout(0.0)
+        self._sock = sock
+        return sock
+
+    def _bind_unix(self):
+        """
+        Create the non-blocking unix datagram socket for local producers,
+        replacing a socket file left behind by an earlier run.  Senders
+        block while its queue is full instead of having datagrams dropped.
+        """
+        path = self._unix_path
+        try:
+            mode = os.stat(path).st_mode
+        except OSError:
+            pass
+        else:
+            if not stat.S_ISSOCK(mode):
+                self.exit(E_NOTSOCKET % path)
+            os.unlink(path)
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        if self._rcvbuf:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, self._rcvbuf)
+        sock.bind(path)
+        sock.settimeout(0.0)
+        self._unix_sock = sock
+        return sock
+
+    def _serve(self, sock):
+        "Receive loop: process datagrams from sock until the shutdown."
         while 1:
             try:
-                data, _ = self._sock.recvfrom(MAX_PACKET)
-                for p in data.split('\n'):
-                    if p:
-                        self._process(p)
+                socket.wait_read(sock.fileno())
+                self._drain(sock)
             except Exception, ex:
                 self.error(str(ex))
 
-    def _shutdown(self):
-        "Shutdown the server"
-        self.exit("service exiting", code=0)
+    def _fork_workers(self):
+        "Fork the worker processes, keeping a control socket to each."
+        # workers inherit these ignored: a SIGINT or SIGTERM sent to the
+        # whole process group is the parent's to act on, and a SIGUSR1
+        # arriving before a worker sets up its handler must not kill it
+        for signum in (signal.SIGINT, signal.SIGTERM, signal.SIGUSR1):
+            signal.signal(signum, signal.SIG_IGN)
+        for i in xrange(self._workers):
+            ours, theirs = socket.socketpair()
+            pid = gevent.fork()
+            if pid == 0:
+                ours.close()
+                for ctrl in self._worker_ctrls:
+                    ctrl.close()
+                # the earlier workers are the parent's to signal
+                self._worker_pids = []
+                self._worker_ctrls = []
+                try:
+                    self._run_worker(theirs)
+                finally:
+                    os._exit(0)
+            theirs.close()
+            self._worker_pids.append(pid)
+            self._worker_ctrls.append(ours)
+
+    def _run_worker(self, ctrl):
+        "Body of a worker process."
+        # the parent owns shutdown, so SIGINT and SIGTERM stay ignored;
+        # workers exit when their control socket is closed.
+        _signal_handler(signal.SIGUSR1, self._profile)
+        if self._profile_at_start:
+            self._profile()
+        sock = self._bind(reuse_port=True)
+        gevent.spawn(self._serve_control, ctrl)
+        if self._unix_sock is not None:
+            gevent.spawn(self._serve, self._unix_sock)
+        self._serve(sock)
+
+    def _serve_control(self, ctrl):
+        "Hand the current interval's stats to the parent on each request."
+        while 1:
+            if not ctrl.recv(1):
+                os._exit(0)
+            stats = self._rotate_stats()
+            send_frame(ctrl, cPickle.dumps(stats, cPickle.HIGHEST_PROTOCOL))
+            self._spare = self._new_stats(stats)
+
+    def _collect_workers(self):
+        """
+        Rotate every worker's stats and merge them into one interval.  A
+        worker that cannot be reached, or does not hand its stats over
+        within a flush interval, is killed and dropped.
+        """
+        stats = self._rotate_stats()
+        asked = []
+        for pid, ctrl in zip(self._worker_pids, self._worker_ctrls):
+            try:
+                ctrl.sendall('F')
+                asked.append((pid, ctrl))
+            except socket.error, ex:
+                self._lose_worker(pid, ctrl, ex)
+        deadline = time.time() + self._interval
+        for pid, ctrl in asked:
+            try:
+                with gevent.Timeout(max(deadline - time.time(), 0.001)):
+                    data = recv_frame(ctrl)
+                stats.merge(cPickle.loads(data))
+            except (Exception, gevent.Timeout), ex:
+                self._lose_worker(pid, ctrl, ex)
+        return stats
+
+    def _lose_worker(self, pid, ctrl, ex):
+        "Kill a worker that failed and stop collecting from it."
+        self.error(E_WORKER % (pid, ex or 'timed out'))
+        self._worker_pids.remove(pid)
+        self._worker_ctrls.remove(ctrl)
+        self._workers_lost += 1
+        ctrl.close()
+        try:
+            os.kill(pid, signal.SIGKILL)
+        except OSError:
+            pass
+
+    def _drain(self, sock):
+        """
+        Read up to self._batch datagrams from the non-blocking sock without
+        going back to the hub, then parse the whole batch in one pass.
+        Returns the number of datagrams read.
+        """
+        batch = self._recv_batch(sock)
+        num = len(batch)
+        if not num:
+            return 0
+
+        stats = self._stats
+        stats.recv_wakeups += 1
+        stats.recv_datagrams += num
+        if num > stats.recv_batch_max:
+            stats.recv_batch_max = num
+        lines = '\n'.join(batch)
+        stats.recv_bytes += len(lines) - num + 1
+        stats.recv_metrics += self._process_lines(stats, lines.split('\n'))
+        return num
+
+    def _recv_batch(self, sock):
+        "Read up to self._batch datagrams from the non-blocking sock."
+        recv = sock.recv
+        batch = []
+        while len(batch) < self._batch:
+            try:
+                batch.append(recv(MAX_PACKET))
+            except socket.error, ex:
+                if ex.args[0] not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    raise
+                break
+        return batch
+
+    def _process_lines(self, stats, lines):
+        "Process each non-empty line, returning how many there were."
+        process = self._process
+        count = 0
+        for p in lines:
+            if p:
+                count += 1
+                try:
+                    process(p)
+                except Exception, ex:
+                    stats.parse_errors += 1
+                    self.error(str(ex))
+        return count
+
+    def _listen_tcp(self):
+        "Start accepting metric streams on the tcp address."
+        self._tcp_server = StreamServer(self._tcp_addr, self._serve_tcp)
+        self._tcp_server.start()
+        return self._tcp_server
+
+    def _listen_relay(self):
+        "Start accepting intervals forwarded by downstream daemons."
+        self._relay_server = StreamServer(self._relay_addr, self._serve_relay)
+        self._relay_server.start()
+        return self._relay_server
+
+    def _serve_relay(self, sock, addr):
+        """
+        Merge the intervals a downstream daemon forwards over one connection
+        into the current interval.  The downstream's own metrics are
+        reported as relay.<source>.<name> under the stats prefix.
+        """
+        try:
+            while 1:
+                try:
+                    data = recv_frame(sock)
+                except EOFError:
+                    break
+                received = Stats()
+                source = codec.decode(data, received)
+                stats = self._stats
+                stats.merge(received)
+                stats.relay_intervals += 1
+                stats.relay_bytes += FRAME_HEADER.size + len(data)
+                internal = stats.relayed
+                for name, val in received.internal.iteritems():
+                    internal['relay.%s.%s' % (source, name)] = val
+        except (socket.error, ValueError, zlib.error), ex:
+            self.error(E_RELAY % (addr, ex))
+        finally:
+            sock.close()
+
+    def _serve_tcp(self, sock, addr):
+        """
+        Process newline-framed metrics from one tcp connection.
+
+        Data is read in chunks of up to TCP_READ bytes and each chunk is
+        parsed before the next is read, so a producer that outpaces the
+        parser fills the socket buffers and is held back by tcp flow
+        control.  The hub is yielded to between chunks, so a busy
+        connection cannot starve the UDP socket or the flush.  Throughput
+        is counted per peer host, summed over its connections.
+        """
+        peer = (addr[0] or 'localhost').replace('.', '_').replace(':', '_')
+        self._tcp_open += 1
+        started = time.time()
+        total_bytes = total_metrics = 0
+        pending = ''
+        try:
+            while 1:
+                data = sock.recv(TCP_READ)
+                if not data:
+                    break
+                lines = (pending + data).split('\n')
+                pending = lines.pop()
+                stats = self._stats
+                if len(pending) > TCP_READ:
+                    # a line that long is not a metric; skip to the next
+                    stats.parse_errors += 1
+                    pending = ''
+                count = self._process_lines(stats, lines)
+                counters = stats.tcp.get(peer)
+                if counters is None:
+                    counters = stats.tcp[peer] = [0, 0, 0]
+                counters[0] += len(data)
+                counters[1] += count
+                counters[2] += 1
+                total_bytes += len(data)
+                total_metrics += count
+                gevent.sleep(0)
+            if pending:
+                stats = self._stats
+                self._process_lines(stats, [pending])
+                stats.tcp.setdefault(peer, [0, 0, 0])[1] += 1
+                total_metrics += 1
+        except socket.error, ex:
+            self.error(E_TCPCONN % (addr, ex))
+        finally:
+            self._tcp_open -= 1
+            sock.close()
+        if self._debug:
+            elapsed = max(time.time() - started, 1e-6)
+            self.error(E_TCPDONE % (addr, total_bytes, total_metrics,
+                                    elapsed, total_metrics / elapsed))
+
+    def _checkpoint(self, stats):
+        """
+        Save the aggregates in stats to the checkpoint file in the codec's
+        format, replacing any previous one atomically.
+        """
+        path = self._checkpoint_path
+        tmp = path + '.tmp'
+        try:
+            with open(tmp, 'wb') as fp:
+                fp.write(codec.encode(stats))
+                fp.flush()
+                os.fsync(fp.fileno())
+            os.rename(tmp, path)
+        except EnvironmentError, ex:
+            self.error(E_CHECKPOINT % (path, ex))
+
+    def _restore(self):
+        """
+        Merge the aggregates saved by the previous run into the current
+        interval, then remove the checkpoint so they are counted once.
+        """
+        path = self._checkpoint_path
+        started = time.time()
+        try:
+            with open(path, 'rb') as fp:
+                data = fp.read()
+        except IOError, ex:
+            if ex.errno != errno.ENOENT:
+                self.error(E_RESTORE % (path, ex))
+            return
+        saved = Stats()
+        try:
+            codec.decode(data, saved)
+            self._stats.merge(saved)
+            os.unlink(path)
+        except (ValueError, zlib.error, OSError), ex:
+            self.error(E_RESTORE % (path, ex))
+            return
+        if self._debug:
+            keys = sum(map(len, (saved.counts, saved.gauges, saved.timers,
+                                 saved.sets)))
+            self.error(E_RESTORED % (path, keys,
+                                     (time.time() - started) * 1000.0))
+
+    def _profile(self):
+        """
+        Time the receive and flush stages of this process for
+        profile_seconds, sampling its stack too if asked, then write the
+        results to the profile directory.  Started by SIGUSR1, which the
+        parent passes on to its workers.  Outside a profile the stages run
+        unwrapped, so they cost nothing extra.
+        """
+        for pid in self._worker_pids:
+            try:
+                os.kill(pid, signal.SIGUSR1)
+            except OSError:
+                pass
+        if self._profiler is not None:
+            return
+        profiler = self._profiler = Profiler(self._profile_sample)
+        for name, stage in PROFILE_STAGES:
+            profiler.wrap(self, name, stage)
+        self._sink.profile(profiler)
+        gevent.spawn_later(self._profile_seconds, self._end_profile)
+
+    def _end_profile(self):
+        "Stop the current profile and write it out."
+        profiler, self._profiler = self._profiler, None
+        if profiler is None:
+            return
+        profiler.stop()
+        base = os.path.join(self._profile_dir, 'gstatsd-%d-%d'
+                            % (os.getpid(), int(profiler.started)))
+        try:
+            paths = profiler.dump(base)
+        except EnvironmentError, ex:
+            self.error(E_PROFILE % (base, ex))
+            return
+        self.error(E_PROFILED % ', '.join(paths))
+
+    def _shutdown(self, code=0):
+        """
+        Shutdown the server.  Receiving stops first, so with a checkpoint
+        path the saved interval, along with any flush cut short, holds
+        everything received.  Payloads still queued for graphite get one
+        send timeout to go out; any left after that go to the spool, if
+        there is one.  A second signal during the shutdown is ignored.
+        """
+        if self._stopping is not None:
+            return
+        self._stopping = gevent.getcurrent()
+        gevent.killall(self._receivers)
+        for server in (self._tcp_server, self._relay_server):
+            if server is not None:
+                server.stop()
+        task = self._flush_task
+        if task is not None and task is not gevent.getcurrent():
+            task.kill()
+        if self._checkpoint_path:
+            stats = self._rotate()
+            if self._flushing is not None:
+                self._flushing.merge(stats)
+                stats = self._flushing
+            self._checkpoint(stats)
+        if self._unix_sock is not None:
+            try:
+                os.unlink(self._unix_path)
+            except OSError:
+                pass
+        for ctrl in self._worker_ctrls:
+            ctrl.close()
+        self._sink.close(self._interval)
+        self.exit("service exiting", code=code)
+
+    def _admit(self, raw):
+        """
+        Look up the key for raw and admit it to the current interval.
+
+        Once the interval holds max_keys distinct keys, metrics for any
+        further key are folded into the overflow key; once a key prefix (its
+        first prefix_depth components) holds max_prefix_keys, further keys
+        under it fold into <prefix>.overflow.  Folded metrics are counted.
+        Rejected keys are not remembered, so a key explosion costs no memory
+        beyond the caps.  The heaviest keys are tracked by metrics received,
+        and prefixes by distinct keys (rejected keys count once per metric).
+        """
+        key = self._lookup(raw)
+        stats = self._stats
+        if stats.top_keys is not None:
+            stats.top_keys.add(key)
+        admitted = stats.admitted
+        if key in admitted:
+            return key
+
+        depth = self._prefix_depth
+        prefix = '.'.join(key.split('.', depth)[:depth])
+        if stats.top_prefixes is not None:
+            stats.top_prefixes.add(prefix)
+        if self._max_keys and len(admitted) >= self._max_keys:
+            stats.overflowed += 1
+            return self._overflow_key
+        if self._max_prefix_keys:
+            prefix_keys = stats.prefix_keys
+            if prefix_keys[prefix] >= self._max_prefix_keys:
+                stats.overflowed += 1
+                return '%s.%s' % (prefix, OVERFLOW)
+            prefix_keys[prefix] += 1
+        admitted.add(key)
+        return key
+
+    def _make_key(self, raw):
+        "Sanitize a raw packet key and add the key prefix."
+        key = raw.translate(KEY_TABLE, KEY_DELETIONS)
+        if self._key_prefix:
+            key = '.'.join([self._key_prefix, key])
+        return key
 
     def _process(self, data):
         "Process a single packet and update the internal tables."
@@ -195,32 +1162,40 @@ class StatsDaemon(object):
 
         # interpret the packet and update stats
         stats = self._stats
-        key = parts[0].translate(KEY_TABLE, KEY_DELETIONS)
-        if self._key_prefix:
-            key = '.'.join([self._key_prefix, key])
+        key = self._key(parts[0])
         for part in parts[1:]:
             srate = 1.0
             fields = part.split('|')
             length = len(fields)
             if length < 2:
+                stats.parse_errors += 1
                 continue
             value = fields[0]
             stype = fields[1].strip()
 
-            with stats_lock:
-                # timer (milliseconds)
-                if stype == 'ms':
-                    stats.timers[key].append(float(value if value else 0))
+            # timer (milliseconds)
+            if stype == 'ms':
+                if length == 3 and fields[2].startswith('@'):
+                    srate = float(fields[2][1:])
+                    if 0 < srate < 1:
+                        stats.timer_weights[key] += 1 / srate - 1
+                stats.timers[key].append(float(value if value else 0))
+
+            # counter with optional sample rate
+            elif stype == 'c':
+                if length == 3 and fields[2].startswith('@'):
+                    srate = float(fields[2][1:])
+                value = float(value if value else 1) * (1 / srate)
+                stats.counts[key] += value
+            elif stype == 'g':
+                value = float(value if value else 1)
+                stats.gauges[key] = value
 
-                # counter with optional sample rate
-                elif stype == 'c':
-                    if length == 3 and fields[2].startswith('@'):
-                        srate = float(fields[2][1:])
-                    value = float(value if value else 1) * (1 / srate)
-                    stats.counts[key] += value
-                elif stype == 'g':
-                    value = float(value if value else 1)
-                    stats.gauges[key] = value
+            # set of unique members
+            elif stype == 's':
+                stats.sets[key].add(value)
+            else:
+                stats.parse_errors += 1
 
 
 def main():
@@ -228,8 +1203,20 @@ def main():
         add_help_option=False)
     opts.add_option('-b', '--bind', dest='bind_addr', default=':8125',
         help="bind [host]:port (host defaults to '')")
+    opts.add_option('--tcp', dest='tcp_bind_addr', default=None,
+        metavar='BIND',
+        help="also accept newline-separated metrics over tcp on "
+             "[host]:port")
+    opts.add_option('--unix-socket', dest='unix_path', default=None,
+        metavar='PATH',
+        help="also accept datagrams on a unix domain socket at PATH")
+    opts.add_option('--relay', dest='relay_bind_addr', default=None,
+        metavar='BIND',
+        help="also merge intervals forwarded by downstream daemons "
+             "(-P forward) on [host]:port")
     opts.add_option('-s', '--sink', dest='sink', action='append', default=[],
-        help="a graphite service to which stats are sent ([host]:port).")
+        help="a graphite service to which stats are sent "
+             "([host]:port[:instance]).")
     opts.add_option('-v', dest='verbose', action='count', default=0,
         help="increase verbosity (currently used for debugging)")
     opts.add_option('-f', '--flush', dest='interval', default=INTERVAL,
@@ -237,7 +1224,107 @@ def main():
     opts.add_option('-x', '--prefix', dest='key_prefix', default='',
         help="key prefix added to all keys (default None)")
     opts.add_option('-p', '--percent', dest='percent', default=PERCENT,
-        help="percent threshold (default 90)")
+        help="comma-separated percent thresholds, e.g. 50,90,99.9 "
+             "(default 90)")
+    opts.add_option('-t', '--timers', dest='timer_mode', default=TIMER_EXACT,
+        type='choice', choices=sorted(TIMER_MODES),
+        help="timer storage: 'exact' keeps every sample, 'sketch' keeps a "
+             "bounded log-bucketed histogram per key (default exact)")
+    opts.add_option('-H', '--histogram', dest='bins', default='',
+        help="comma-separated upper bounds of timer histogram bins "
+             "(default none)")
+    opts.add_option('-B', '--batch', dest='batch', default=BATCH, type='int',
+        help="max datagrams read per wakeup of the receive loop "
+             "(default %d)" % BATCH)
+    opts.add_option('-R', '--rcvbuf', dest='rcvbuf', default=0, type='int',
+        help="socket receive buffer size in bytes (default system)")
+    opts.add_option('-w', '--workers', dest='workers', default=1, type='int',
+        help="number of receiving processes sharing the port through "
+             "SO_REUSEPORT (default 1)")
+    opts.add_option('-c', '--compact', dest='compact', action='store_true',
+        help="store samples unboxed in arrays to reduce memory use")
+    opts.add_option('-K', '--key-cache', dest='key_cache', default=KEY_CACHE,
+        type='int', help="number of sanitized keys to cache, 0 disables "
+                         "(default %d)" % KEY_CACHE)
+    opts.add_option('-r', '--retries', dest='retries', default=sink.RETRIES,
+        type='int', help="times to retry a failed send to a graphite host "
+                         "within the flush interval (default %d)"
+                         % sink.RETRIES)
+    opts.add_option('-T', '--timeout', dest='timeout', default=None,
+        type='float', help="seconds allowed for each send to a graphite "
+                           "host (default the flush interval)")
+    opts.add_option('-q', '--queue', dest='queue_size',
+        default=sink.QUEUE_SIZE, type='int',
+        help="flushes queued per graphite host before the oldest is "
+             "dropped (default %d)" % sink.QUEUE_SIZE)
+    opts.add_option('-P', '--protocol', dest='protocol', default=sink.LINE,
+        type='choice', choices=[sink.LINE, sink.PICKLE, sink.FORWARD],
+        help="graphite protocol: 'line' (plaintext, port 2003) or 'pickle' "
+             "(batched, port 2004), or 'forward' to send each interval's "
+             "aggregates to upstream gstatsd daemons listening with "
+             "--relay (default line)")
+    opts.add_option('--pickle-batch', dest='pickle_batch',
+        default=sink.PICKLE_BATCH, type='int',
+        help="datapoints per pickle protocol message (default %d)"
+             % sink.PICKLE_BATCH)
+    opts.add_option('--shard', dest='replicas', type='int', default=None,
+        metavar='REPLICAS',
+        help="send each metric to REPLICAS graphite hosts chosen by a "
+             "carbon-relay compatible consistent hash, instead of to all "
+             "of them")
+    opts.add_option('--spool', dest='spool_dir', default=None, metavar='DIR',
+        help="keep flushes a graphite host could not take in a file per "
+             "host under DIR and replay them once it is back")
+    opts.add_option('--spool-size', dest='spool_size', type='int',
+        default=sink.SPOOL_SIZE, metavar='BYTES',
+        help="size of each host's spool file; the oldest flushes are "
+             "dropped when it is full (default %d)" % sink.SPOOL_SIZE)
+    opts.add_option('--replay-rate', dest='replay_rate', type='int',
+        default=sink.REPLAY_RATE, metavar='BYTES',
+        help="bytes per second replayed from a spool (default %d)"
+             % sink.REPLAY_RATE)
+    opts.add_option('--checkpoint', dest='checkpoint', default=None,
+        metavar='PATH',
+        help="save the current interval's aggregates to PATH on SIGINT or "
+             "SIGTERM and merge them back in on startup")
+    opts.add_option('--profile', dest='profile', action='store_true',
+        help="profile the daemon's stages from startup; SIGUSR1 starts a "
+             "profile at any time")
+    opts.add_option('--profile-seconds', dest='profile_seconds',
+        type='float', default=PROFILE_SECONDS, metavar='SECONDS',
+        help="length of each profile (default %d)" % PROFILE_SECONDS)
+    opts.add_option('--profile-sample', dest='profile_sample', type='float',
+        default=0.0, metavar='MS',
+        help="also sample the stack every MS milliseconds of cpu time "
+             "while profiling (default 0, off)")
+    opts.add_option('--profile-dir', dest='profile_dir', default=None,
+        metavar='DIR',
+        help="directory profiles are written to (default %s)"
+             % tempfile.gettempdir())
+    opts.add_option('--stats-prefix', dest='stats_prefix',
+        default=STATS_PREFIX,
+        help="namespace of the daemon's own metrics (default %s)"
+             % STATS_PREFIX)
+    opts.add_option('--max-keys', dest='max_keys', type='int', default=0,
+        help="distinct keys per flush interval; metrics for further keys "
+             "are folded into the key '%s' (default unlimited)" % OVERFLOW)
+    opts.add_option('--max-prefix-keys', dest='max_prefix_keys', type='int',
+        default=0,
+        help="distinct keys per key prefix per flush interval; further keys "
+             "are folded into '<prefix>.%s' (default unlimited)" % OVERFLOW)
+    opts.add_option('--prefix-depth', dest='prefix_depth', type='int',
+        default=PREFIX_DEPTH,
+        help="number of leading key components that form its prefix "
+             "(default %d)" % PREFIX_DEPTH)
+    opts.add_option('--top-keys', dest='top_keys', type='int', default=0,
+        metavar='NUM',
+        help="log the NUM heaviest keys, by metrics received, and key "
+             "prefixes, by distinct keys, every flush (default 0, off)")
+    opts.add_option('--set-precision', dest='set_precision', type='int',
+        default=hll.PRECISION,
+        help="sets past 2**PRECISION / 16 members are counted by a "
+             "HyperLogLog of 2**PRECISION bytes, %d to %d (default %d)"
+             % (hll.MIN_PRECISION, hll.MAX_PRECISION, hll.PRECISION))
     opts.add_option('-D', '--daemonize', dest='daemonize', action='store_true',
         help='daemonize the service')
     opts.add_option('-h', '--help', dest='usage', action='store_true')
@@ -254,7 +1341,21 @@ def main():
         daemonize()
 
     sd = StatsDaemon(options.bind_addr, options.sink, options.interval,
-                     options.percent, options.verbose, options.key_prefix)
+                     options.percent, options.verbose, options.key_prefix,
+                     options.timer_mode, options.bins, options.compact,
+                     options.batch, options.rcvbuf, options.workers,
+                     options.key_cache, options.retries, options.timeout,
+                     options.queue_size, options.protocol,
+                     options.pickle_batch, options.replicas,
+                     options.stats_prefix, options.max_keys,
+                     options.max_prefix_keys, options.prefix_depth,
+                     options.top_keys, options.set_precision,
+                     options.tcp_bind_addr, options.unix_path,
+                     options.relay_bind_addr, options.spool_dir,
+                     options.spool_size, options.replay_rate,
+                     options.checkpoint, options.profile,
+                     options.profile_seconds, options.profile_sample,
+                     options.profile_dir)
     sd.start()
 
 
@@ -1,9 +1,18 @@
 
 # standard
+import os
+import shutil
+import signal
+import socket
+import tempfile
+import time
 import unittest
 
 # local
-from gstatsd import service
+from gstatsd import client, service, sink
+
+# vendor
+import gevent, gevent.os
 
 
 class StatsServiceTest(unittest.TestCase):
@@ -19,7 +28,7 @@ class StatsServiceTest(unittest.TestCase):
         self.assertEquals(svc._bindaddr, ('', 8125))
         self.assertEquals(svc._interval, 5.0)
         self.assertEquals(svc._debug, 0)
-        self.assertEquals(stats.percent, 90.0)
+        self.assertEquals(stats.percents, [90.0])
         self.assertEquals(svc._sink._hosts, [('', 2003)])
 
         svc = service.StatsDaemon('bar:8125', ['foo:2003'], 5, 90, 1)
@@ -27,6 +36,22 @@ class StatsServiceTest(unittest.TestCase):
         self.assertEquals(svc._sink._hosts, [('foo', 2003)])
         self.assertEquals(svc._debug, 1)
 
+    def test_percents(self):
+        svc = service.StatsDaemon('8125', ['2003'], 5, '99.9,50, 90', 0,
+                                  bins='100,10')
+        self.assertEquals(svc._stats.percents, [99.9, 50.0, 90.0])
+        self.assertEquals(svc._stats.bins, [10.0, 100.0])
+
+        # thresholds outside (0, 100] are refused at startup
+        class QuietDaemon(service.StatsDaemon):
+            def error(self, msg):
+                pass
+        for percent in ('150', '90,0', '-5'):
+            self.assertRaises(SystemExit, QuietDaemon, '8125', ['2003'], 5,
+                              percent, 0)
+        svc = QuietDaemon('8125', ['2003'], 5, '100', 0)
+        self.assertEquals(svc._stats.percents, [100.0])
+
     def test_backend(self):
         service.StatsDaemon._send_foo = lambda self, x, y: None
         svc = service.StatsDaemon('8125', ['bar:2003'], 5, 90, 0)
@@ -55,6 +80,453 @@ class StatsServiceTest(unittest.TestCase):
         self.svc._process(pkt)
         self.assertEquals(self.stats.timers, {'foo': [20.0, 10.0]})
 
+    def test_timers_sampled(self):
+        # each sample at rate 0.25 stands for 4, as for counters
+        for pkt in ('foo:20|ms|@0.25', 'foo:10|ms|@0.25', 'foo:5|ms'):
+            self.svc._process(pkt)
+        self.assertEquals(self.stats.timers, {'foo': [20.0, 10.0, 5.0]})
+        self.assertEquals(self.stats.timer_weights, {'foo': 6.0})
+        points = dict(sink.datapoints(self.stats))
+        self.assertEquals(points['stats.timers.foo.count'], 9.0)
+        self.assertEquals(points['stats.timers.foo.sum'], 35.0)
+
+        other = service.Stats()
+        other.timer_weights['foo'] += 1.0
+        self.stats.merge(other)
+        self.assertEquals(self.stats.timer_weights, {'foo': 7.0})
+
+        # a zero rate carries no weight rather than failing the line
+        self.svc._process('bar:1|ms|@0')
+        self.assertEquals(self.stats.timers['bar'], [1.0])
+        self.assertFalse('bar' in self.stats.timer_weights)
+
+    def test_timers_sketch(self):
+        args = (':8125', [':2003'], 5, 90, 0, '', service.TIMER_SKETCH)
+        svc = service.StatsDaemon(*args)
+        svc._process('foo:20|ms')
+        svc._process('foo:10|ms')
+        timer = svc._stats.timers['foo']
+        self.assertEquals(len(timer), 2)
+        self.assertEquals((timer.min, timer.max), (10.0, 20.0))
+
+    def test_sets(self):
+        for pkt in ('users:alice|s', 'users:bob|s', 'users:alice|s',
+                    'ips:10.0.0.1|s'):
+            self.svc._process(pkt)
+        sets = self.stats.sets
+        self.assertEquals(sorted(sets), ['ips', 'users'])
+        self.assertEquals(sets['users'].cardinality(), 2)
+        self.assertEquals(sets['ips'].cardinality(), 1)
+
+        other = service.Stats()
+        other.sets['users'].add('carol')
+        other.sets['users'].add('bob')
+        self.stats.merge(other)
+        self.assertEquals(sets['users'].cardinality(), 3)
+
+        svc = service.StatsDaemon(':8125', [':2003'], 5, 90, 0,
+                                  set_precision=6)
+        for i in range(1000):
+            svc._process('ids:%d|s' % i)
+        ids = svc._stats.sets['ids']
+        self.assertFalse(ids.exact)
+        self.assertEquals(len(ids._registers), 64)
+
+    def test_compact(self):
+        svc = service.StatsDaemon(':8125', [':2003'], 5, 90, 0, compact=True)
+        for pkt in ('foo:1|c', 'foo:2|c', 'bar:3|g', 'bar:4|g', 'baz:5|ms'):
+            svc._process(pkt)
+        stats = svc._stats
+        self.assertEquals(dict(stats.counts.iteritems()), {'foo': 3})
+        self.assertEquals(dict(stats.gauges.iteritems()), {'bar': 4})
+        self.assertEquals(stats.timers['baz'].tolist(), [5.0])
+
+        # the next interval reuses the slot index but starts out empty
+        svc._reset_stats()
+        self.assertEquals(dict(svc._stats.counts.iteritems()), {})
+        self.assertTrue('foo' not in svc._stats.counts)
+        svc._process('qux:1|c')
+        self.assertEquals(dict(svc._stats.counts.iteritems()), {'qux': 1})
+        self.assertEquals(dict(stats.counts.iteritems()), {'foo': 3})
+
+    def test_rotate(self):
+        self.svc._process('foo:1|c')
+        stats = self.svc._rotate_stats()
+        self.assertTrue(stats is self.stats)
+        self.assertEquals(stats.counts, {'foo': 1})
+        self.svc._process('foo:2|c')
+        self.assertEquals(self.svc._stats.counts, {'foo': 2})
+        self.assertEquals(self.svc._stats.percents, [90.0])
+        self.assertTrue(self.svc._rotate_stats() is not stats)
+
+    def test_next_flush(self):
+        self.assertEquals(self.svc._next_flush(1003.2), 1005.0)
+        self.assertEquals(self.svc._next_flush(1005.0), 1010.0)
+
+    def test_flush(self):
+        delivered = []
+        self.svc._sink.deliver = lambda payloads, interval: \
+            delivered.append((payloads, interval))
+        self.svc._process('foo:1|c')
+        self.svc._flush(self.svc._rotate_stats(), 100)
+        [(payloads, interval)] = delivered
+        self.assertEquals(interval, 5.0)
+        [(host, data)] = payloads
+        self.assertEquals(host, ('', 2003))
+        self.assertTrue('stats_counts.foo 1.000000 100' in data.splitlines())
+
+    def test_flush_yields(self):
+        # formatting runs in another thread, so the hub keeps running
+        ticks = []
+        def tick():
+            while 1:
+                ticks.append(1)
+                gevent.sleep(0.01)
+        self.svc._sink.prepare = lambda stats, now: time.sleep(0.1) or []
+        self.svc._sink.deliver = lambda payloads, interval: None
+        ticker = gevent.spawn(tick)
+        gevent.sleep(0)
+        self.svc._flush(self.svc._rotate_stats(), 100)
+        ticker.kill()
+        self.assertTrue(len(ticks) > 2)
+
+    def test_drain(self):
+        svc = service.StatsDaemon(':8125', [':2003'], 5, 90, 0, batch=3)
+        sock = service.socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.bind(('127.0.0.1', 0))
+        sock.settimeout(0.0)
+        cli = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        for i in range(4):
+            # a trailing newline does not count as a metric
+            cli.sendto('foo:1|c\nbar:%d|ms\n' % i, sock.getsockname())
+        self.assertEquals(svc._drain(sock), 3)
+        self.assertEquals(svc._drain(sock), 1)
+        self.assertEquals(svc._drain(sock), 0)
+        stats = svc._stats
+        self.assertEquals(stats.counts, {'foo': 4})
+        self.assertEquals(stats.timers, {'bar': [0.0, 1.0, 2.0, 3.0]})
+        self.assertEquals((stats.recv_wakeups, stats.recv_datagrams,
+                           stats.recv_batch_max, stats.recv_metrics),
+                          (2, 4, 3, 8))
+        sock.close()
+        cli.close()
+
+    def test_tcp(self):
+        svc = service.StatsDaemon(':8125', [':2003'], 5, 90, 0,
+                                  tcp_bindaddr='127.0.0.1:0')
+        server = svc._listen_tcp()
+        cli = service.socket.create_connection(('127.0.0.1',
+                                                server.server_port))
+        cli.sendall('foo:1|c\nbar:')
+        gevent.sleep(0.05)
+        self.assertEquals(svc._tcp_open, 1)
+        cli.sendall('2|ms\nfoo:2|c\nbaz:')
+        cli.sendall('5|g')
+        cli.close()
+        gevent.sleep(0.05)
+        server.stop()
+        stats = svc._stats
+        self.assertEquals(stats.counts, {'foo': 3})
+        self.assertEquals(stats.timers, {'bar': [2.0]})
+        self.assertEquals(stats.gauges, {'baz': 5.0})
+        self.assertEquals(svc._tcp_open, 0)
+        nbytes, metrics, reads = stats.tcp['127_0_0_1']
+        self.assertEquals(nbytes, 32)
+        self.assertEquals(metrics, 4)
+        svc._instrument(stats)
+        self.assertEquals(stats.internal['tcp.127_0_0_1.bytes'], 32)
+        self.assertEquals(stats.internal['tcpConnections'], 0)
+
+    def test_unix_socket(self):
+        tmp = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmp, 'gstatsd.sock')
+            open(path, 'w').close()
+            svc = service.StatsDaemon(':8125', [':2003'], 5, 90, 0,
+                                      unix_path=path)
+            svc.error = lambda msg: None
+            self.assertRaises(SystemExit, svc._bind_unix)
+
+            # a stale socket is replaced
+            os.unlink(path)
+            stale = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+            stale.bind(path)
+            stale.close()
+            sock = svc._bind_unix()
+            cli = client.StatsClient(path)
+            cli.increment('foo')
+            cli.timer('bar', 3)
+            self.assertEquals(svc._drain(sock), 2)
+            self.assertEquals(svc._stats.counts, {'foo': 1})
+            self.assertEquals(svc._stats.timers, {'bar': [3.0]})
+            sock.close()
+        finally:
+            shutil.rmtree(tmp)
+
+    def test_relay(self):
+        upstream = service.StatsDaemon(':8125', [':2003'], 5, 90, 0,
+                                       relay_bindaddr='127.0.0.1:0')
+        server = upstream._listen_relay()
+        upstream._process('foo:1|c')
+        upstream._process('t:1|ms')
+
+        downstream = service.StatsDaemon(
+            ':8125', ['127.0.0.1:%d' % server.server_port], 5, 90, 0,
+            protocol=sink.FORWARD, timer_mode=service.TIMER_SKETCH)
+        downstream._sink._source = 'web1'
+        for pkt in ('foo:2|c', 't:3|ms', 't:5|ms', 'g:7|g', 'u:a|s'):
+            downstream._process(pkt)
+        stats = downstream._rotate_stats()
+        downstream._instrument(stats)
+        downstream._sink.send(stats)
+        gevent.sleep(0.1)
+        server.stop()
+
+        stats = upstream._rotate_stats()
+        self.assertEquals(stats.counts, {'foo': 3})
+        self.assertEquals(stats.gauges, {'g': 7})
+        timer = stats.timers['t']
+        self.assertEquals((timer.count, timer.min, timer.max), (3, 1.0, 5.0))
+        self.assertEquals(stats.sets['u'].cardinality(), 1)
+        upstream._instrument(stats)
+        self.assertEquals(stats.internal['relayIntervals'], 1)
+        self.assertEquals(stats.internal['relay.web1.counterKeys'], 1)
+
+    def test_checkpoint(self):
+        tmp = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmp, 'gstatsd.ckpt')
+            svc = service.StatsDaemon(':8125', [':2003'], 5, 90, 0,
+                                      checkpoint=path)
+            svc.error = lambda msg: None
+            svc._restore()
+            for pkt in ('foo:1|c', 't:3|ms', 'u:a|s', 'g:2|g'):
+                svc._process(pkt)
+
+            # a flush cut short by the shutdown is saved too
+            svc._flushing = svc._rotate_stats()
+            for pkt in ('foo:2|c', 't:5|ms', 'u:b|s', 'g:7|g'):
+                svc._process(pkt)
+            self.assertRaises(SystemExit, svc._shutdown)
+            self.assertFalse(os.path.exists(path + '.tmp'))
+
+            svc = service.StatsDaemon(':8125', [':2003'], 5, 90, 0,
+                                      checkpoint=path)
+            svc._process('foo:4|c')
+            svc._restore()
+            stats = svc._stats
+            self.assertEquals(stats.counts, {'foo': 7})
+            self.assertEquals(stats.gauges, {'g': 7})
+            self.assertEquals(sorted(stats.timers['t']), [3.0, 5.0])
+            self.assertEquals(stats.sets['u'].cardinality(), 2)
+            self.assertFalse(os.path.exists(path))
+
+            # a damaged checkpoint is reported and left alone
+            with open(path, 'wb') as fp:
+                fp.write('garbage')
+            errors = []
+            svc.error = errors.append
+            svc._restore()
+            self.assertEquals(len(errors), 1)
+            self.assertEquals(svc._stats.counts, {'foo': 7})
+        finally:
+            shutil.rmtree(tmp)
+
+    def test_profile(self):
+        tmp = tempfile.mkdtemp()
+        try:
+            svc = service.StatsDaemon(':8125', [':2003'], 5, 90, 0,
+                                      profile_dir=tmp)
+            messages = []
+            svc.error = messages.append
+            key = svc._key
+            svc._profile()
+            svc._process_lines(svc._stats, ['foo:1|c', 'bar:2|ms'])
+            svc._end_profile()
+            self.assertEquals(svc._key, key)
+            self.assertFalse('_process' in svc.__dict__)
+            self.assertEquals(svc._stats.counts, {'foo': 1})
+
+            path, = os.listdir(tmp)
+            self.assertEquals(messages, ['profile written to %s'
+                                         % os.path.join(tmp, path)])
+            with open(os.path.join(tmp, path)) as fp:
+                rows = dict((line.split()[0], line.split()[1])
+                            for line in fp if not line.startswith('#'))
+            self.assertEquals(rows['parse'], '1')
+            self.assertEquals(rows['packet'], '2')
+            self.assertEquals(rows['key'], '2')
+        finally:
+            shutil.rmtree(tmp)
+
+    def test_merge(self):
+        one = service.StatsDaemon(':8125', [':2003'], 5, 90, 0)
+        two = service.StatsDaemon(':8125', [':2003'], 5, 90, 0, compact=True)
+        for pkt in ('foo:1|c', 'bar:1|g', 'baz:1|ms'):
+            one._process(pkt)
+        for pkt in ('foo:2|c', 'bar:2|g', 'baz:2|ms', 'qux:3|ms'):
+            two._process(pkt)
+        stats = one._stats
+        stats.merge(two._stats)
+        self.assertEquals(stats.counts, {'foo': 3})
+        self.assertEquals(stats.gauges, {'bar': 2})
+        self.assertEquals(stats.timers, {'baz': [1.0, 2.0], 'qux': [3.0]})
+
+        sketch = service.StatsDaemon(':8125', [':2003'], 5, 90, 0, '',
+                                     service.TIMER_SKETCH)
+        sketch._process('baz:3|ms')
+        stats.merge(sketch._stats)
+        self.assertEquals(stats.timers['baz'].count, 3)
+        self.assertEquals(stats.timers['baz'].max, 3.0)
+
+    def test_shutdown(self):
+        tmp = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmp, 'gstatsd.ckpt')
+            svc = service.StatsDaemon(':8125', [':2003'], 5, 90, 0,
+                                      checkpoint=path)
+            svc.error = lambda msg: None
+            received = []
+
+            def receive():
+                while 1:
+                    svc._process('foo:1|c')
+                    received.append(1)
+                    gevent.sleep(0.005)
+
+            def close(interval):
+                gevent.sleep(0.05)
+                # a second signal while the sink drains changes nothing
+                svc._shutdown()
+
+            svc._receivers = [gevent.spawn(receive)]
+            svc._sink.close = close
+            gevent.sleep(0.02)
+            self.assertRaises(SystemExit, svc._shutdown)
+
+            # nothing is received once the shutdown starts
+            svc = service.StatsDaemon(':8125', [':2003'], 5, 90, 0,
+                                      checkpoint=path)
+            svc._restore()
+            self.assertEquals(svc._stats.counts, {'foo': len(received)})
+        finally:
+            shutil.rmtree(tmp)
+
+    def test_collect_workers(self):
+        parent = service.StatsDaemon(':8125', [':2003'], 5, 90, 0)
+        workers = []
+        for i in range(2):
+            worker = service.StatsDaemon(':8125', [':2003'], 5, 90, 0,
+                                         compact=True)
+            worker._process('foo:%d|c' % (i + 1))
+            worker._process('bar:%d|ms' % i)
+            ours, theirs = service.socket.socketpair()
+            parent._worker_ctrls.append(ours)
+            parent._worker_pids.append(i)
+            workers.append(gevent.spawn(worker._serve_control, theirs))
+        stats = parent._collect_workers()
+        gevent.killall(workers)
+        self.assertEquals(stats.counts, {'foo': 3})
+        self.assertEquals(sorted(stats.timers['bar']), [0.0, 1.0])
+
+    def test_fork_workers(self):
+        svc = service.StatsDaemon(':8125', [':2003'], 5, 90, 0, workers=2)
+
+        signums = (signal.SIGINT, signal.SIGTERM, signal.SIGUSR1)
+
+        def run_worker(ctrl):
+            ignored = all(signal.getsignal(signum) == signal.SIG_IGN
+                          for signum in signums)
+            ctrl.sendall('%d %d' % (ignored, len(svc._worker_pids)))
+
+        svc._run_worker = run_worker
+        old = [signal.getsignal(signum) for signum in signums]
+        try:
+            svc._fork_workers()
+        finally:
+            for signum, handler in zip(signums, old):
+                signal.signal(signum, handler)
+        # workers leave shutdown to the parent, ignore SIGUSR1 until they
+        # handle it and never see their siblings
+        for pid, ctrl in zip(svc._worker_pids, svc._worker_ctrls):
+            self.assertEquals(ctrl.recv(16), '1 0')
+            ctrl.close()
+            gevent.os.waitpid(pid, 0)
+
+    def test_lose_workers(self):
+        parent = service.StatsDaemon(':8125', [':2003'], 0.1, 90, 0)
+        parent.error = lambda msg: None
+        worker = service.StatsDaemon(':8125', [':2003'], 5, 90, 0)
+        worker._process('foo:1|c')
+        pids = []
+        for i in range(3):
+            pid = gevent.fork()
+            if not pid:
+                time.sleep(10)
+                os._exit(0)
+            pids.append(pid)
+            ours, theirs = service.socket.socketpair()
+            parent._worker_ctrls.append(ours)
+            parent._worker_pids.append(pid)
+            if i == 0:
+                serving = gevent.spawn(worker._serve_control, theirs)
+            elif i == 1:
+                # exited: the request cannot be sent
+                ours.close()
+            else:
+                # hung: the stats never come back
+                silent = theirs
+        stats = parent._collect_workers()
+        serving.kill()
+        silent.close()
+        self.assertEquals(stats.counts, {'foo': 1})
+        self.assertEquals(parent._worker_pids, pids[:1])
+        self.assertEquals(parent._workers_lost, 2)
+        for pid in pids[1:]:
+            self.assertEquals(gevent.os.waitpid(pid, 0)[1], 9)
+        os.kill(pids[0], 9)
+        gevent.os.waitpid(pids[0], 0)
+
+    def test_parse_errors(self):
+        for pkt in ('foo:1', 'foo:1|x', 'foo:1|c:2|c'):
+            self.svc._process(pkt)
+        self.assertEquals(self.stats.parse_errors, 2)
+        self.assertEquals(self.stats.counts, {'foo': 3})
+
+    def test_instrument(self):
+        self.svc._process('foo:1|c')
+        self.svc._process('bar:1|ms')
+        stats = self.svc._rotate_stats()
+        self.svc._instrument(stats)
+        internal = stats.internal
+        self.assertEquals(internal['counterKeys'], 1)
+        self.assertEquals(internal['timerKeys'], 1)
+        self.assertEquals(internal['gaugeKeys'], 0)
+        self.assertEquals(internal['keyCacheMisses'], 2)
+        lines = self.svc._sink.format(stats, 100).splitlines()
+        self.assertTrue('statsd.counterKeys 1 100' in lines)
+        self.assertTrue('statsd.numStats 2 100' in lines)
+
+    def test_udp_socket_stats(self):
+        fd, path = tempfile.mkstemp()
+        os.write(fd, '''\
+  sl  local_address rem_address   st tx_queue rx_queue tr tm->when \
+retrnsmt   uid  timeout inode ref pointer drops
+  1: 00000000:1FBD 00000000:0000 07 00000000:00000200 00:00000000 \
+00000000     0        0 1 2 0000000000000000 5
+  2: 0100007F:1FBD 00000000:0000 07 00000000:00000100 00:00000000 \
+00000000     0        0 1 2 0000000000000000 7
+  3: 00000000:0035 00000000:0000 07 00000000:00000000 00:00000000 \
+00000000     0        0 1 2 0000000000000000 9
+''')
+        os.close(fd)
+        try:
+            self.assertEquals(service.udp_socket_stats(8125, [path]),
+                              (12, 0x300))
+            self.assertEquals(service.udp_socket_stats(1, [path]), None)
+        finally:
+            os.unlink(path)
+
     def test_key_sanitize(self):
         pkt = '\t\n#! foo . bar \0 ^:1|c'
         self.svc._process(pkt)
@@ -67,6 +539,60 @@ class StatsServiceTest(unittest.TestCase):
         svc._process(pkt)
         self.assertEquals(svc._stats.counts, {'pfx.foo': 1})
 
+    def test_key_cache(self):
+        for pkt in ('foo:1|c', 'foo:1|c', 'b#ar:1|c'):
+            self.svc._process(pkt)
+        stats = self.svc._rotate_stats()
+        self.assertEquals(stats.counts, {'foo': 2, 'bar': 1})
+        self.assertEquals((stats.key_hits, stats.key_misses), (1, 2))
+
+        svc = service.StatsDaemon(':8125', [':2003'], 5, 90, 0, key_cache=0)
+        svc._process('b#ar:1|c')
+        self.assertEquals(svc._stats.counts, {'bar': 1})
+        self.assertTrue(svc._key_cache is None)
+
+    def test_max_keys(self):
+        svc = service.StatsDaemon(':8125', [':2003'], 5, 90, 0, max_keys=2)
+        for pkt in ('a:1|c', 'b:1|ms', 'c:1|c', 'a:1|c', 'd:2|ms', 'c:1|c'):
+            svc._process(pkt)
+        stats = svc._rotate_stats()
+        self.assertEquals(stats.counts, {'a': 2, 'overflow': 2})
+        self.assertEquals(stats.timers, {'b': [1.0], 'overflow': [2.0]})
+        self.assertEquals(stats.overflowed, 3)
+        svc._instrument(stats)
+        self.assertEquals(stats.internal['overflowMetrics'], 3)
+
+        # the cap is per interval
+        svc._process('c:1|c')
+        self.assertEquals(svc._stats.counts, {'c': 1})
+
+    def test_max_prefix_keys(self):
+        svc = service.StatsDaemon(':8125', [':2003'], 5, 90, 0,
+                                  max_prefix_keys=2, prefix_depth=2)
+        for i in range(5):
+            svc._process('api.req.%d:1|c' % i)
+        svc._process('api.other:1|c')
+        svc._process('api.req.0:1|c')
+        self.assertEquals(svc._stats.counts, {'api.req.0': 2, 'api.req.1': 1,
+                                              'api.req.overflow': 3,
+                                              'api.other': 1})
+        self.assertEquals(svc._stats.overflowed, 3)
+
+    def test_top_keys(self):
+        svc = service.StatsDaemon(':8125', [':2003'], 5, 90, 0, top_keys=3)
+        logged = []
+        svc.error = logged.append
+        for i in range(10):
+            svc._process('app.req%d:1|c' % i)
+            svc._process('hot:1|c')
+        stats = svc._rotate_stats()
+        self.assertEquals(stats.top_keys.top(1), [('hot', 10, 0)])
+        self.assertEquals(stats.top_prefixes.top(1), [('app', 10, 0)])
+        svc._report_top(stats)
+        self.assertEquals(logged[0].split()[:5],
+                          ['top', 'keys', 'of', '20:', 'hot=10'])
+        self.assertEquals(logged[1], 'top prefixes of 11: app=10 hot=1')
+
 
 def main():
     unittest.main()
@@ -1,14 +1,51 @@
 
 # standard
+import cPickle
 import cStringIO
+import os
+import socket as pysocket
+import struct
 import sys
 import time
+from collections import deque
+
+# local
+import codec
+import summary
+from spool import Spool
+from hashing import ConsistentHashRing
 
 # vendor
-from gevent import socket
+import gevent, gevent.event
+from gevent import select, socket
+
+# constants
+RETRIES = 3
+BACKOFF = 0.1
+MAX_BACKOFF = 5.0
+CONNECT_TIMEOUT = 5.0
+QUEUE_SIZE = 10
+PICKLE_BATCH = 500
+ROUTE_CACHE = 100000
+SPOOL_SIZE = 64 * 1024 * 1024
+REPLAY_RATE = 256 * 1024
+PICKLE_HEADER = struct.Struct('!L')
+
+# protocols
+LINE = 'line'
+PICKLE = 'pickle'
+FORWARD = 'forward'
 
 E_BADSPEC = "bad sink spec %r: %s"
+E_DUPNODE = "sink %r shares the ring node (%r, %r) with %s:%d; give each " \
+    "sink on the same server its own instance, as in carbon's DESTINATIONS"
 E_SENDFAIL = 'failed to send stats to %s %s: %s'
+E_DROPPED = 'dropped stats for %s %s: %d payloads pending'
+E_SPOOLFAIL = 'cannot spool stats for %s %s: %s'
+
+
+def _format_pct(pct):
+    return ('%f' % pct).rstrip('0').rstrip('.').replace('.', '_')
 
 
 class Sink(object):
@@ -32,76 +69,498 @@ class Sink(object):
         raise ValueError("expected '[host]:port' but got %r" % spec)
 
 
+class Connection(object):
+
+    """
+    A long-lived TCP connection to one host, reopened on demand.
+    """
+
+    def __init__(self, host, retries=RETRIES):
+        self.host = host
+        self.retries = retries
+        self._sock = None
+
+    def close(self):
+        if self._sock is not None:
+            try:
+                self._sock.close()
+            except Exception:
+                pass
+            self._sock = None
+
+    def _stale(self):
+        "Graphite never writes back, so a readable socket has been closed."
+        readable, _, _ = select.select([self._sock], [], [], 0)
+        if readable:
+            try:
+                return not self._sock.recv(4096)
+            except socket.error:
+                return True
+        return False
+
+    def send(self, data, deadline):
+        """
+        Send data, reconnecting and retrying up to self.retries times with
+        exponential backoff as long as the deadline (a time.time() value)
+        allows.  The last error is raised once the attempts run out.
+        """
+        delay = BACKOFF
+        attempt = 0
+        while 1:
+            try:
+                if self._sock is not None and self._stale():
+                    self.close()
+                remaining = max(deadline - time.time(), 0.001)
+                if self._sock is None:
+                    self._sock = socket.create_connection(
+                        self.host, min(remaining, CONNECT_TIMEOUT))
+                self._sock.settimeout(remaining)
+                self._sock.sendall(data)
+                return
+            except Exception:
+                self.close()
+                attempt += 1
+                if attempt > self.retries or time.time() + delay >= deadline:
+                    raise
+                gevent.sleep(delay)
+                delay = min(delay * 2, MAX_BACKOFF)
+
+
+class HostSender(object):
+
+    """
+    Delivers payloads to one host from its own greenlet, so a slow or
+    unreachable host delays neither the flush loop nor the other hosts.
+    At most `size` payloads wait in the queue; when it is full the oldest
+    one is dropped to make room for fresh data.
+
+    With a spool, payloads that fail to send or are pushed out of the
+    queue are kept on disk instead of dropped.  Once a send succeeds again
+    they are replayed oldest first whenever the queue is empty, at no more
+    than replay_rate bytes per second, so the backlog neither delays fresh
+    data nor floods a host that has just come back.
+    """
+
+    def __init__(self, conn, size=QUEUE_SIZE, name='graphite', spool=None,
+                 replay_rate=REPLAY_RATE):
+        self.conn = conn
+        self.size = size
+        self.name = name
+        self.spool = spool
+        self.replay_rate = float(replay_rate)
+        self.sent = 0
+        self.dropped = 0
+        self.failed = 0
+        self.replayed = 0
+        self.latency = 0.0
+        self._healthy = True
+        self._timeout = CONNECT_TIMEOUT
+        self._replay_at = 0.0
+        self._sending = None
+        self._queue = deque()
+        self._ready = gevent.event.Event()
+        self._idle = gevent.event.Event()
+        self._idle.set()
+        self._task = gevent.spawn(self._run)
+
+    def __len__(self):
+        return len(self._queue)
+
+    def error(self, msg):
+        sys.stderr.write(msg + '\n')
+
+    def put(self, data, timeout):
+        "Queue data to be sent within timeout seconds of leaving the queue."
+        if len(self._queue) >= self.size:
+            old, _ = self._queue.popleft()
+            if not self._spill(old):
+                self.error(E_DROPPED % (self.name, self.conn.host, self.size))
+        self._queue.append((data, timeout))
+        self._idle.clear()
+        self._ready.set()
+
+    def drain(self, timeout):
+        """
+        Wait up to timeout seconds for the queued payloads to be sent or
+        given up on.  Returns True if the queue emptied in time.
+        """
+        return self._idle.wait(timeout)
+
+    def stop(self):
+        "Stop sending, moving the payloads not yet sent to the spool."
+        self._task.kill()
+        self.conn.close()
+        if self.spool is not None:
+            if self._sending is not None:
+                self._spill(self._sending)
+            while self._queue:
+                self._spill(self._queue.popleft()[0])
+            self.spool.close()
+            self.spool = None
+
+    def reset_counters(self):
+        """
+        Return (sent, failed, dropped, replayed, max latency in seconds)
+        since the last call and zero them.
+        """
+        counters = (self.sent, self.failed, self.dropped, self.replayed,
+                    self.latency)
+        self.sent = self.failed = self.dropped = self.replayed = 0
+        self.latency = 0.0
+        return counters
+
+    def spooled(self):
+        "Number of payloads waiting in the spool."
+        return len(self.spool) if self.spool is not None else 0
+
+    def _spill(self, data):
+        "Keep data in the spool, returning False if it had to be dropped."
+        if self.spool is None:
+            self.dropped += 1
+            return False
+        try:
+            self.dropped += self.spool.append(data)
+        except (ValueError, EnvironmentError), ex:
+            self.dropped += 1
+            self.error(E_SPOOLFAIL % (self.name, self.conn.host, ex))
+            return False
+        return True
+
+    def _send(self, data, timeout):
+        "Send data within timeout seconds, returning False on failure."
+        started = time.time()
+        try:
+            with gevent.Timeout(timeout):
+                self.conn.send(data, started + timeout)
+        except (Exception, gevent.Timeout), ex:
+            self.conn.close()
+            self.failed += 1
+            self._healthy = False
+            self.error(E_SENDFAIL % (self.name, self.conn.host, ex))
+            return False
+        self._healthy = True
+        self.latency = max(self.latency, time.time() - started)
+        return True
+
+    def _run(self):
+        queue = self._queue
+        while 1:
+            if not queue:
+                self._idle.set()
+                wait = None
+                if self._healthy and self.spooled():
+                    wait = self._replay_at - time.time()
+                    if wait <= 0:
+                        self._replay()
+                        continue
+                self._ready.clear()
+                self._ready.wait(wait)
+                continue
+            data, timeout = queue.popleft()
+            self._timeout = timeout
+            self._sending = data
+            if self._send(data, timeout):
+                self.sent += 1
+            else:
+                self._spill(data)
+            self._sending = None
+
+    def _replay(self):
+        "Send the oldest spooled payload, leaving it spooled on failure."
+        spool = self.spool
+        data = spool.peek()
+        if data is not None:
+            if not self._send(data, self._timeout):
+                return
+            self.replayed += 1
+            if self.replay_rate:
+                self._replay_at = time.time() + len(data) / self.replay_rate
+        spool.pop()
+
+
 class GraphiteSink(Sink):
 
     """
     Sends stats to one or more Graphite servers.
+
+    By default every host receives every datapoint.  With replicas set,
+    each datapoint instead goes to that many hosts chosen by a consistent
+    hash ring compatible with carbon-relay's, so hosts given as
+    host:port:instance match the relay's DESTINATIONS.  As with the
+    relay's DIVERSE_REPLICAS, no two replicas share a server.
     """
 
-    def __init__(self):
+    def __init__(self, retries=RETRIES, timeout=None, queue_size=QUEUE_SIZE,
+                 replicas=None):
         self._hosts = []
+        self._nodes = {}
+        self._senders = {}
+        self._retries = retries
+        self._timeout = timeout
+        self._queue_size = queue_size
+        self._replicas = replicas
+        self._ring = None
+        self._routes = {}
+        self._spool_dir = None
+        self._spool_size = SPOOL_SIZE
+        self._replay_rate = REPLAY_RATE
+        self._profiler = None
+
+    name = 'graphite'
+
+    def close(self, interval=0.0):
+        """
+        Stop every host's sender, after giving them one send timeout (by
+        default interval) between them to send what is still queued.
+        """
+        deadline = time.time() + (self._timeout or interval)
+        for sender in self._senders.values():
+            sender.drain(max(deadline - time.time(), 0))
+        for sender in self._senders.values():
+            sender.stop()
+
+    def profile(self, profiler):
+        """
+        Time formatting and each host's sends with profiler, including
+        hosts first sent to while it is active.
+        """
+        self._profiler = profiler
+        profiler.wrap(self, 'prepare', 'format')
+        for sender in self._senders.values():
+            profiler.wrap(sender, '_send', 'send')
+
+    def spool_to(self, directory, size=SPOOL_SIZE, replay_rate=REPLAY_RATE):
+        """
+        Keep payloads each host could not take in a spool file of at most
+        size bytes under directory, replayed at replay_rate bytes per
+        second once the host is back.
+        """
+        self._spool_dir = directory
+        self._spool_size = size
+        self._replay_rate = replay_rate
+
+    def _spool_path(self, host):
+        name = '%s_%s_%d.spool' % (self.name, host[0] or 'localhost', host[1])
+        return os.path.join(self._spool_dir, name)
+
+    def _sender(self, host):
+        sender = self._senders.get(host)
+        if sender is None:
+            conn = Connection(host, self._retries)
+            spool = None
+            if self._spool_dir is not None:
+                spool = Spool(self._spool_path(host), self._spool_size)
+            sender = HostSender(conn, self._queue_size, self.name, spool,
+                                self._replay_rate)
+            self._senders[host] = sender
+            if self._profiler is not None and self._profiler.active:
+                self._profiler.wrap(sender, '_send', 'send')
+        return sender
+
+    def host_stats(self):
+        """
+        Generate (name, value) pairs describing the sends to each host since
+        the last call, for the daemon's self-instrumentation.
+        """
+        for host in self._hosts:
+            sender = self._senders.get(host)
+            if sender is None:
+                continue
+            sent, failed, dropped, replayed, latency = sender.reset_counters()
+            name = host[0].replace('.', '_') or 'localhost'
+            name = '%s.%s_%d' % (self.name, name, host[1])
+            yield name + '.sent', sent
+            yield name + '.sendFailures', failed
+            yield name + '.dropped', dropped
+            yield name + '.sendLatency', latency * 1000.0
+            yield name + '.queued', len(sender)
+            if sender.spool is not None:
+                yield name + '.spooled', sender.spooled()
+                yield name + '.replayed', replayed
 
     def add(self, spec):
-        self._hosts.append(self._parse_hostport(spec))
+        instance = None
+        if spec.count(':') == 2:
+            spec, instance = spec.rsplit(':', 1)
+        host = self._parse_hostport(spec)
+        node = (host[0], instance or None)
+        if self._replicas and node in self._nodes:
+            other = self._nodes[node]
+            raise ValueError(E_DUPNODE % ((spec,) + node + other))
+        self._hosts.append(host)
+        self._nodes[node] = host
+        self._ring = None
+        self._routes = {}
 
     def send(self, stats):
         "Format stats and send to one or more Graphite hosts"
+        self.deliver(self.prepare(stats, int(time.time())), stats.interval)
+
+    def prepare(self, stats, now):
+        """
+        Summarize and format stats, returning a list of (host, data) pairs.
+        This is CPU-bound and touches no gevent objects, so it may run in a
+        thread other than the hub's.
+        """
+        if self._replicas:
+            return self._shard(stats, now)
+        data = self.format(stats, now)
+        return [(host, data) for host in self._hosts]
+
+    def deliver(self, payloads, interval):
+        """
+        Hand the payloads to each host's sender; by default every send must
+        complete within one flush interval.
+        """
+        timeout = self._timeout or interval
+        for host, data in payloads:
+            self._sender(host).put(data, timeout)
+
+    def _route(self, name):
+        "Hosts that own the metric name."
+        hosts = self._routes.get(name)
+        if hosts is None:
+            if self._ring is None:
+                self._ring = ConsistentHashRing(self._nodes)
+            if len(self._routes) >= ROUTE_CACHE:
+                self._routes = {}
+            nodes = self._ring.get_nodes(name, self._replicas, diverse=True)
+            hosts = self._routes[name] = [self._nodes[node] for node in nodes]
+        return hosts
+
+    def _shard(self, stats, now):
+        "Split the datapoints by owning host in one pass and format each."
+        groups = dict((host, []) for host in self._hosts)
+        route = self._route
+        for point in datapoints(stats):
+            for host in route(point[0]):
+                groups[host].append(point)
+        return [(host, self.render(points, now))
+                for host, points in groups.iteritems() if points]
+
+    def format(self, stats, now):
+        "Render all of an interval's datapoints."
+        return self.render(datapoints(stats), now)
+
+    def render(self, points, now):
+        "Render (name, value) pairs in Graphite's plaintext line protocol"
         buf = cStringIO.StringIO()
-        now = int(time.time())
-        num_stats = 0
-
-        # timer stats
-        pct = stats.percent
-        timers = stats.timers
-        for key, vals in timers.iteritems():
-            if not vals:
-                continue
+        write = buf.write
+        for name, val in points:
+            if type(val) is int:
+                write('%s %d %d\n' % (name, val, now))
+            else:
+                write('%s %f %d\n' % (name, val, now))
+        return buf.getvalue()
 
-            # compute statistics
-            num = len(vals)
-            vals = sorted(vals)
-            vmin = vals[0]
-            vmax = vals[-1]
-            mean = vmin
-            max_at_thresh = vmax
-            if num > 1:
-                idx = round((pct / 100.0) * num)
-                tmp = vals[:int(idx)]
-                if tmp:
-                    max_at_thresh = tmp[-1]
-                    mean = sum(tmp) / idx
-
-            key = 'stats.timers.%s' % key
-            buf.write('%s.mean %f %d\n' % (key, mean, now))
-            buf.write('%s.upper %f %d\n' % (key, vmax, now))
-            buf.write('%s.upper_%d %f %d\n' % (key, pct, max_at_thresh, now))
-            buf.write('%s.lower %f %d\n' % (key, vmin, now))
-            buf.write('%s.count %d %d\n' % (key, num, now))
-            num_stats += 1
-
-        # counter stats
-        counts = stats.counts
-        for key, val in counts.iteritems():
-            buf.write('stats.%s %f %d\n' % (key, val / stats.interval, now))
-            buf.write('stats_counts.%s %f %d\n' % (key, val, now))
-            num_stats += 1
-
-        # counter stats
-        gauges = stats.gauges
-        for key, val in gauges.iteritems():
-            buf.write('stats.%s %f %d\n' % (key, val, now))
-            buf.write('stats_counts.%s %f %d\n' % (key, val, now))
-            num_stats += 1
-
-        buf.write('statsd.numStats %d %d\n' % (num_stats, now))
-
-        # TODO: add support for N retries
 
-        for host in self._hosts:
-            # flush stats to graphite
-            try:
-                sock = socket.create_connection(host)
-                sock.sendall(buf.getvalue())
-                sock.close()
-            except Exception, ex:
-                self.error(E_SENDFAIL % ('graphite', host, ex))
+class GraphitePickleSink(GraphiteSink):
+
+    """
+    Sends stats to one or more Graphite servers using the pickle protocol,
+    as length-prefixed pickled lists of at most batch_size datapoints.
+    """
+
+    def __init__(self, retries=RETRIES, timeout=None, queue_size=QUEUE_SIZE,
+                 replicas=None, batch_size=PICKLE_BATCH):
+        GraphiteSink.__init__(self, retries, timeout, queue_size, replicas)
+        self._batch_size = batch_size
+
+    def render(self, points, now):
+        "Render (name, value) pairs in Graphite's pickle protocol"
+        points = [(name, (now, val)) for name, val in points]
+        buf = cStringIO.StringIO()
+        size = self._batch_size
+        for i in xrange(0, len(points), size):
+            data = cPickle.dumps(points[i:i + size], 2)
+            buf.write(PICKLE_HEADER.pack(len(data)))
+            buf.write(data)
+        return buf.getvalue()
+
+
+class ForwardSink(GraphiteSink):
+
+    """
+    Forwards each interval's aggregates to one or more upstream gstatsd
+    daemons listening with --relay, instead of formatting datapoints.
+    Every host receives the whole interval as one frame in the compact
+    binary format of the codec module, so the traffic per interval grows
+    with the number of keys rather than the number of samples, and timer
+    samples or sketches are merged upstream so percentiles stay correct
+    across hosts.
+    """
+
+    name = 'forward'
+
+    def __init__(self, retries=RETRIES, timeout=None, queue_size=QUEUE_SIZE,
+                 source=None):
+        GraphiteSink.__init__(self, retries, timeout, queue_size)
+        if source is None:
+            source = pysocket.gethostname().split('.')[0]
+        self._source = source
+
+    def prepare(self, stats, now):
+        data = codec.frame(codec.encode(stats, self._source))
+        return [(host, data) for host in self._hosts]
+
+
+def datapoints(stats):
+    """
+    Generate the (name, value) pairs reported for an interval.  Values
+    that are naturally whole numbers, like counts, are ints.
+    """
+    num_stats = 0
+
+    # timer stats
+    bins = stats.bins
+    if bins:
+        bin_names = ['bin_%s' % _format_pct(edge) for edge in bins]
+        bin_names.append('bin_inf')
+    timers = summary.summarize(stats.timers, stats.percents, bins)
+    timer_weights = stats.timer_weights
+    for key, summ in timers:
+        count = summ.count
+        if key in timer_weights:
+            count += timer_weights[key]
+        key = 'stats.timers.%s' % key
+        _, mean, _ = summ.thresholds[0]
+        yield key + '.mean', mean
+        yield key + '.upper', summ.upper
+        for pct, pct_mean, pct_upper in summ.thresholds:
+            pct = _format_pct(pct)
+            yield '%s.upper_%s' % (key, pct), pct_upper
+            yield '%s.mean_%s' % (key, pct), pct_mean
+        yield key + '.lower', summ.lower
+        yield key + '.count', count
+        yield key + '.sum', summ.sum
+        yield key + '.median', summ.median
+        yield key + '.std', summ.std
+        if summ.bins:
+            for name, num in zip(bin_names, summ.bins):
+                yield '%s.histogram.%s' % (key, name), num
+        num_stats += 1
+
+    # counter stats
+    counts = stats.counts
+    for key, val in counts.iteritems():
+        yield 'stats.' + key, val / stats.interval
+        yield 'stats_counts.' + key, val
+        num_stats += 1
+
+    # gauge stats
+    gauges = stats.gauges
+    for key, val in gauges.iteritems():
+        yield 'stats.' + key, val
+        yield 'stats_counts.' + key, val
+        num_stats += 1
+
+    # set stats: the (estimated) number of unique members
+    for key, val in stats.sets.iteritems():
+        yield 'stats.sets.%s.count' % key, val.cardinality()
+        num_stats += 1
+
+    # the daemon's own metrics
+    prefix = stats.stats_prefix
+    yield prefix + '.numStats', num_stats
+    for name, val in sorted(stats.internal.iteritems()):
+        yield '%s.%s' % (prefix, name), val
@@ -0,0 +1,354 @@
+
+# standard
+import cPickle
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+# local
+from gstatsd import service, sink
+from gstatsd.profiling import Profiler
+
+# vendor
+import gevent
+from gevent import socket
+
+
+class FakeGraphite(object):
+
+    "Accepts connections and records what each one sent."
+
+    def __init__(self):
+        self.sock = socket.socket()
+        self.sock.bind(('127.0.0.1', 0))
+        self.sock.listen(5)
+        self.addr = self.sock.getsockname()
+        self.conns = []
+        self.received = []
+        self._readers = []
+        self._task = gevent.spawn(self._accept)
+
+    def _accept(self):
+        while 1:
+            conn, _ = self.sock.accept()
+            self.conns.append(conn)
+            self._readers.append(gevent.spawn(self._read, conn))
+
+    def _read(self, conn):
+        while 1:
+            data = conn.recv(65536)
+            if not data:
+                break
+            self.received.append(data)
+
+    def drop(self, num):
+        "Close the num'th connection, as a restarting graphite would."
+        self._readers[num].kill()
+        self.conns[num].close()
+
+    def close(self):
+        self._task.kill()
+        gevent.killall(self._readers)
+        for conn in self.conns:
+            conn.close()
+        self.sock.close()
+
+
+class ConnectionTest(unittest.TestCase):
+
+    def setUp(self):
+        self.graphite = FakeGraphite()
+
+    def tearDown(self):
+        self.graphite.close()
+
+    def test_persistent(self):
+        conn = sink.Connection(self.graphite.addr)
+        conn.send('a 1 1\n', time.time() + 1)
+        conn.send('b 1 1\n', time.time() + 1)
+        gevent.sleep(0.05)
+        self.assertEquals(len(self.graphite.conns), 1)
+        self.assertEquals(''.join(self.graphite.received), 'a 1 1\nb 1 1\n')
+        conn.close()
+
+    def test_reconnect(self):
+        conn = sink.Connection(self.graphite.addr)
+        conn.send('a 1 1\n', time.time() + 1)
+        gevent.sleep(0.05)
+        self.graphite.drop(0)
+        gevent.sleep(0.05)
+        conn.send('b 1 1\n', time.time() + 1)
+        gevent.sleep(0.05)
+        self.assertEquals(len(self.graphite.conns), 2)
+        self.assertEquals(''.join(self.graphite.received), 'a 1 1\nb 1 1\n')
+        conn.close()
+
+    def test_retries(self):
+        addr = self.graphite.addr
+        self.graphite.close()
+        conn = sink.Connection(addr, retries=2)
+        start = time.time()
+        self.assertRaises(socket.error, conn.send, 'a 1 1\n', start + 5)
+        # two retries back off for 0.1 + 0.2 seconds
+        self.assertTrue(0.3 <= time.time() - start < 1.0)
+        # the deadline cuts the retries short
+        conn = sink.Connection(addr, retries=10)
+        start = time.time()
+        self.assertRaises(socket.error, conn.send, 'a 1 1\n', start + 0.5)
+        self.assertTrue(time.time() - start < 0.5)
+
+
+class SlowConnection(object):
+
+    def __init__(self, host, delay):
+        self.host = host
+        self.delay = delay
+        self.sent = []
+
+    def send(self, data, deadline):
+        gevent.sleep(self.delay)
+        self.sent.append(data)
+
+    def close(self):
+        pass
+
+
+class GraphiteSinkTest(unittest.TestCase):
+
+    def setUp(self):
+        self.sink = sink.GraphiteSink(timeout=0.2, queue_size=2)
+        self.sink.add('fast:2003')
+        self.sink.add('slow:2003')
+        self.fast = SlowConnection(('fast', 2003), 0)
+        self.slow = SlowConnection(('slow', 2003), 10)
+        for conn in (self.fast, self.slow):
+            self.sink._senders[conn.host] = sink.HostSender(conn, 2)
+        self.sink._senders[self.slow.host].error = lambda msg: None
+
+    def tearDown(self):
+        for sender in self.sink._senders.values():
+            sender.stop()
+
+    def test_fanout(self):
+        start = time.time()
+        stats = service.Stats()
+        stats.counts['foo'] += 1
+        for i in range(5):
+            self.sink.send(stats)
+            gevent.sleep(0)
+        self.assertTrue(time.time() - start < 0.1)
+        gevent.sleep(0.05)
+        self.assertEquals(len(self.fast.sent), 5)
+        self.assertEquals(self.slow.sent, [])
+
+        # the slow host times out on its first payload and drops the
+        # oldest of the rest, leaving two queued
+        slow = self.sink._senders[self.slow.host]
+        self.assertEquals(slow.dropped, 2)
+        gevent.sleep(0.3)
+        self.assertEquals(slow.failed, 1)
+
+    def test_close(self):
+        self.fast.delay = 0.05
+        stats = service.Stats()
+        stats.counts['foo'] += 1
+        for i in range(2):
+            self.sink.send(stats)
+        # queued payloads get one send timeout to go out, shared by all
+        # the hosts
+        start = time.time()
+        self.sink.close()
+        self.assertTrue(time.time() - start < 0.3)
+        self.assertEquals(len(self.fast.sent), 2)
+        self.assertEquals(self.slow.sent, [])
+
+
+class FlakyConnection(SlowConnection):
+
+    def __init__(self, host):
+        SlowConnection.__init__(self, host, 0)
+        self.down = True
+
+    def send(self, data, deadline):
+        if self.down:
+            raise socket.error('connection refused')
+        SlowConnection.send(self, data, deadline)
+
+
+class SpoolTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.conn = FlakyConnection(('flaky', 2003))
+        spool = sink.Spool(os.path.join(self.tmp, 'flaky.spool'), 1024)
+        self.sender = sink.HostSender(self.conn, 2, spool=spool,
+                                      replay_rate=20)
+        self.sender.error = lambda msg: None
+
+    def tearDown(self):
+        self.sender.stop()
+        shutil.rmtree(self.tmp)
+
+    def test_replay(self):
+        for data in 'ab':
+            self.sender.put(data, 0.1)
+        gevent.sleep(0.01)
+        self.assertEquals(self.sender.spooled(), 2)
+        self.assertEquals(self.sender.failed, 2)
+
+        # nothing is replayed until a fresh payload gets through, which
+        # goes first; then the spool drains in order at 20 bytes/s
+        self.conn.down = False
+        gevent.sleep(0.1)
+        self.assertEquals(self.conn.sent, [])
+        self.sender.put('c', 0.1)
+        gevent.sleep(0.01)
+        self.assertEquals(self.conn.sent, ['c', 'a'])
+        gevent.sleep(0.06)
+        self.assertEquals(self.conn.sent, ['c', 'a', 'b'])
+        self.assertEquals(self.sender.spooled(), 0)
+        self.assertEquals(self.sender.reset_counters()[:4], (1, 2, 0, 2))
+
+    def test_overflow(self):
+        self.conn.delay = 10
+        self.conn.down = False
+        for data in 'abcd':
+            self.sender.put(data, 5)
+        # 'c' and 'd' pushed the oldest out of the queue into the spool
+        self.assertEquals(self.sender.spooled(), 2)
+        self.assertEquals(self.sender.dropped, 0)
+        self.assertEquals(self.sender.spool.peek(), 'a')
+
+
+    def test_stop(self):
+        self.conn.delay = 10
+        self.conn.down = False
+        for data in 'ab':
+            self.sender.put(data, 5)
+        gevent.sleep(0.01)
+        path = self.sender.spool.path
+        self.sender.stop()
+        spool = sink.Spool(path, 1024)
+        self.assertEquals(len(spool), 2)
+        self.assertEquals(spool.peek(), 'a')
+        spool.close()
+
+
+class FormatTest(unittest.TestCase):
+
+    def setUp(self):
+        self.stats = service.Stats()
+        self.stats.timers['t'].extend([1.0, 2.0, 3.0])
+        self.stats.counts['c'] += 20
+        self.stats.gauges['g'] = 5.0
+        self.stats.sets['s'].add('a')
+        self.stats.sets['s'].add('b')
+
+    def test_line(self):
+        lines = sink.GraphiteSink().format(self.stats, 100).splitlines()
+        self.assertTrue('stats.timers.t.upper_90 3.000000 100' in lines)
+        self.assertTrue('stats.timers.t.count 3 100' in lines)
+        self.assertTrue('stats.c 2.000000 100' in lines)
+        self.assertTrue('stats_counts.c 20.000000 100' in lines)
+        self.assertTrue('stats.g 5.000000 100' in lines)
+        self.assertTrue('stats.sets.s.count 2 100' in lines)
+        self.assertTrue('statsd.numStats 4 100' in lines)
+
+    def test_pickle(self):
+        data = sink.GraphitePickleSink(batch_size=4).format(self.stats, 100)
+        lines = sink.GraphiteSink().format(self.stats, 100).splitlines()
+        points = []
+        while data:
+            size, = sink.PICKLE_HEADER.unpack(data[:4])
+            batch = cPickle.loads(data[4:4 + size])
+            self.assertTrue(len(batch) <= 4)
+            points.extend(batch)
+            data = data[4 + size:]
+        self.assertEquals(len(points), len(lines))
+        self.assertTrue(('stats.timers.t.count', (100, 3)) in points)
+        self.assertTrue(('stats_counts.c', (100, 20.0)) in points)
+
+
+class PrepareTest(unittest.TestCase):
+
+    def test_prepare(self):
+        graphite = sink.GraphiteSink()
+        graphite.add('foo:2003')
+        graphite.add('bar:2003')
+        stats = service.Stats()
+        stats.counts['c'] += 1
+        data = graphite.format(stats, 100)
+        self.assertEquals(graphite.prepare(stats, 100),
+                          [(('foo', 2003), data), (('bar', 2003), data)])
+
+
+class ShardTest(unittest.TestCase):
+
+    def test_shard(self):
+        graphite = sink.GraphiteSink(replicas=1)
+        for spec in ('10.0.0.1:2003', '10.0.0.2:2003', '10.0.0.3:2003:a'):
+            graphite.add(spec)
+        stats = service.Stats()
+        for i in range(50):
+            stats.counts['key%d' % i] += 1
+        payloads = dict(graphite._shard(stats, 100))
+        self.assertEquals(sorted(payloads), sorted(graphite._hosts))
+        lines = sum((data.splitlines() for data in payloads.values()), [])
+        self.assertEquals(sorted(lines),
+                          sorted(graphite.format(stats, 100).splitlines()))
+        self.assertEquals(graphite._route('stats.foo'), [('10.0.0.1', 2003)])
+        self.assertEquals(graphite._route('stats_counts.bar'),
+                          [('10.0.0.3', 2003)])
+
+        graphite = sink.GraphiteSink(replicas=2)
+        for spec in ('10.0.0.1:2003', '10.0.0.2:2003', '10.0.0.3:2003:a'):
+            graphite.add(spec)
+        payloads = dict(graphite._shard(stats, 100))
+        total = sum(len(data.splitlines()) for data in payloads.values())
+        lines = graphite.format(stats, 100).splitlines()
+        self.assertEquals(total, 2 * len(lines))
+
+        # replicas go to different servers, as with carbon-relay
+        graphite = sink.GraphiteSink(replicas=2)
+        for spec in ('10.0.0.1:2003', '10.0.0.2:2003', '10.0.0.3:2003:a',
+                     '10.0.0.3:2103:b'):
+            graphite.add(spec)
+        self.assertEquals(graphite._route('stats.k15'),
+                          [('10.0.0.3', 2003), ('10.0.0.2', 2003)])
+
+    def test_duplicate_node(self):
+        # without instances, two ports on one server are one ring node
+        graphite = sink.GraphiteSink(replicas=1)
+        graphite.add(':2003')
+        self.assertRaises(ValueError, graphite.add, ':2103')
+        graphite.add(':2103:b')
+        self.assertEquals(graphite._hosts, [('', 2003), ('', 2103)])
+
+        # every host gets every datapoint when not sharding
+        graphite = sink.GraphiteSink()
+        graphite.add(':2003')
+        graphite.add(':2103')
+        self.assertEquals(len(graphite._hosts), 2)
+
+    def test_profile(self):
+        graphite = sink.GraphiteSink()
+        profiler = Profiler()
+        graphite.profile(profiler)
+        # senders created during the profile are timed as well
+        sender = graphite._sender(('', 2003))
+        self.assertTrue('_send' in sender.__dict__)
+        profiler.stop()
+        self.assertFalse('_send' in sender.__dict__)
+        sender = graphite._sender(('', 2103))
+        self.assertFalse('_send' in sender.__dict__)
+        graphite.close()
+
+
+def main():
+    unittest.main()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,138 @@
+
+# standard
+import bisect
+import math
+
+# constants
+RELATIVE_ACCURACY = 0.01
+MIN_VALUE = 1e-3
+MAX_VALUE = 1e8
+
+
+class TimerSketch(object):
+
+    """
+    Bounded-memory, mergeable summary of timer samples.
+
+    Samples are counted in logarithmically-sized buckets (in the spirit of
+    HDR histograms and DDSketch) so any quantile estimate is within
+    RELATIVE_ACCURACY of a real sample.  Values are clamped to the range
+    [MIN_VALUE, MAX_VALUE] for bucketing, which caps the number of buckets
+    at ~1300 regardless of how many samples arrive.  The count, sum, sum of
+    squares, min and max are tracked exactly.
+    """
+
+    __slots__ = ('count', 'sum', 'sumsq', 'min', 'max', '_buckets')
+
+    _gamma = (1 + RELATIVE_ACCURACY) / (1 - RELATIVE_ACCURACY)
+    _log_gamma = math.log(_gamma)
+    _min_index = int(math.ceil(math.log(MIN_VALUE) / _log_gamma))
+    _max_index = int(math.ceil(math.log(MAX_VALUE) / _log_gamma))
+
+    def __init__(self):
+        self.count = 0
+        self.sum = 0.0
+        self.sumsq = 0.0
+        self.min = float('inf')
+        self.max = float('-inf')
+        self._buckets = {}
+
+    def __len__(self):
+        return self.count
+
+    def __getstate__(self):
+        return (self.count, self.sum, self.sumsq, self.min, self.max,
+                self._buckets)
+
+    def __setstate__(self, state):
+        (self.count, self.sum, self.sumsq, self.min, self.max,
+         self._buckets) = state
+
+    def append(self, val):
+        "Add a single sample."
+        self.count += 1
+        self.sum += val
+        self.sumsq += val * val
+        if val < self.min:
+            self.min = val
+        if val > self.max:
+            self.max = val
+        if val > MIN_VALUE:
+            idx = int(math.ceil(math.log(val) / self._log_gamma))
+            if idx > self._max_index:
+                idx = self._max_index
+        else:
+            idx = self._min_index
+        buckets = self._buckets
+        buckets[idx] = buckets.get(idx, 0) + 1
+
+    def extend(self, vals):
+        "Add every sample in vals."
+        append = self.append
+        for val in vals:
+            append(val)
+
+    def merge(self, other):
+        "Fold the samples summarized by another sketch into this one."
+        if not other.count:
+            return
+        self.count += other.count
+        self.sum += other.sum
+        self.sumsq += other.sumsq
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        buckets = self._buckets
+        for idx, num in other._buckets.iteritems():
+            buckets[idx] = buckets.get(idx, 0) + num
+
+    def _value(self, idx):
+        "Representative value of a bucket, clamped to the observed range."
+        val = 2.0 * self._gamma ** idx / (self._gamma + 1)
+        return min(max(val, self.min), self.max)
+
+    def quantile(self, q):
+        "Estimate the value at quantile q (0 <= q <= 1)."
+        rank = q * (self.count - 1)
+        seen = 0
+        for bucket in sorted(self._buckets):
+            seen += self._buckets[bucket]
+            if seen > rank:
+                return self._value(bucket)
+        return self.max
+
+    def histogram(self, edges):
+        """
+        Count samples into len(edges) + 1 bins, where bin i holds samples
+        in [edges[i - 1], edges[i]) and the last bin is open-ended.
+        """
+        counts = [0] * (len(edges) + 1)
+        for bucket, num in self._buckets.iteritems():
+            counts[bisect.bisect_right(edges, self._value(bucket))] += num
+        return counts
+
+    def summary(self, pct):
+        """
+        Return (lower, upper, mean, upper_pct) where mean is the mean of the
+        samples at or below the pct threshold and upper_pct is the largest
+        of those samples, matching the exact computation in summary.
+        """
+        num = self.count
+        vmin = self.min
+        vmax = self.max
+        mean = vmin
+        max_at_thresh = vmax
+        if num > 1:
+            idx = int(round((pct / 100.0) * num))
+            if idx:
+                seen = 0
+                total = 0.0
+                for bucket in sorted(self._buckets):
+                    take = min(self._buckets[bucket], idx - seen)
+                    val = self._value(bucket)
+                    seen += take
+                    total += take * val
+                    if seen >= idx:
+                        break
+                max_at_thresh = val
+                mean = total / idx
+        return vmin, vmax, mean, max_at_thresh
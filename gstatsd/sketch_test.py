@@ -0,0 +1,79 @@
+
+# standard
+import random
+import unittest
+
+# local
+from gstatsd import summary
+from gstatsd.sketch import TimerSketch, RELATIVE_ACCURACY
+
+
+class TimerSketchTest(unittest.TestCase):
+
+    def _close(self, estimate, exact):
+        tolerance = abs(exact) * RELATIVE_ACCURACY
+        self.assertTrue(abs(estimate - exact) <= tolerance,
+                        '%r not within tolerance of %r' % (estimate, exact))
+
+    def test_single(self):
+        sk = TimerSketch()
+        sk.append(20)
+        self.assertEquals(len(sk), 1)
+        self.assertEquals(sk.summary(90), (20, 20, 20, 20))
+
+    def test_exact_bounds(self):
+        sk = TimerSketch()
+        for val in (5, 1, 300, 0, 42):
+            sk.append(val)
+        vmin, vmax, _, _ = sk.summary(90)
+        self.assertEquals((vmin, vmax), (0, 300))
+        self.assertEquals(sk.count, 5)
+        self.assertEquals(sk.sum, 348)
+
+    def test_matches_exact(self):
+        rnd = random.Random(1)
+        vals = [rnd.expovariate(1 / 50.0) + 1 for i in xrange(10000)]
+        sk = TimerSketch()
+        for val in vals:
+            sk.append(val)
+        for pct in (50, 90, 99):
+            exact = summary._summarize_exact(vals, [pct], None)
+            _, pct_mean, pct_upper = exact.thresholds[0]
+            approx = sk.summary(pct)
+            self.assertEquals(approx[:2], (exact.lower, exact.upper))
+            self._close(approx[2], pct_mean)
+            self._close(approx[3], pct_upper)
+        self._close(sk.quantile(0.5), exact.median)
+        exact = summary._summarize_exact(vals, [], [10, 100]).bins
+        approx = sk.histogram([10, 100])
+        self.assertEquals(sum(approx), len(vals))
+        for num, expect in zip(approx, exact):
+            self.assertTrue(abs(num - expect) < len(vals) * 0.01)
+
+    def test_bounded(self):
+        sk = TimerSketch()
+        val = 1e-6
+        while val < 1e12:
+            sk.append(val)
+            val *= 1.001
+        self.assertTrue(len(sk._buckets) < 1500)
+
+    def test_merge(self):
+        rnd = random.Random(2)
+        vals = [rnd.uniform(1, 1000) for i in xrange(2000)]
+        one, two, both = TimerSketch(), TimerSketch(), TimerSketch()
+        for i, val in enumerate(vals):
+            (one if i % 2 else two).append(val)
+            both.append(val)
+        one.merge(two)
+        self.assertEquals(one.count, both.count)
+        self.assertEquals(one._buckets, both._buckets)
+        self.assertEquals(one.summary(90), both.summary(90))
+
+
+def main():
+    unittest.main()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,138 @@
+
+# standard
+import mmap
+import os
+import struct
+import zlib
+
+# constants
+MAGIC = 'GSP1'
+HEADER = struct.Struct('<4sQQ')
+RECORD = struct.Struct('<II')
+SPOOL_SIZE = 64 * 1024 * 1024
+
+E_TOOBIG = 'payload of %d bytes does not fit a spool of %d bytes'
+
+
+class Spool(object):
+
+    """
+    Size-capped, memory-mapped FIFO of payloads kept in one file.
+
+    Records are appended after the tail as (length, crc32, data) and the
+    header, holding the head and tail offsets, is rewritten after the
+    record, so a crash leaves at worst the last record unwritten.  When a
+    payload does not fit behind the tail, the live records are moved to the
+    front of the file, and when the file is full the oldest records are
+    dropped to make room.  Reopening the file resumes where it left off,
+    discarding any records that fail their checksum.
+    """
+
+    def __init__(self, path, size=SPOOL_SIZE):
+        self.path = path
+        self.size = max(int(size), HEADER.size + RECORD.size + 1)
+        self._count = 0
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0644)
+        try:
+            if os.fstat(fd).st_size != self.size:
+                os.ftruncate(fd, self.size)
+            self._map = mmap.mmap(fd, self.size)
+        finally:
+            os.close(fd)
+        self._head = self._tail = HEADER.size
+        self._recover()
+
+    def __len__(self):
+        return self._count
+
+    @property
+    def used(self):
+        "Bytes held by records."
+        return self._tail - self._head
+
+    def _recover(self):
+        magic, head, tail = HEADER.unpack(self._map[:HEADER.size])
+        if magic != MAGIC or not HEADER.size <= head <= tail <= self.size:
+            self._write_header()
+            return
+        self._head = pos = head
+        while pos < tail:
+            data = self._read(pos, tail)
+            if data is None:
+                break
+            pos += RECORD.size + len(data)
+            self._count += 1
+        self._tail = pos
+        self._write_header()
+
+    def _read(self, pos, end):
+        "The record at pos, or None if it is cut off or corrupt."
+        if pos + RECORD.size > end:
+            return None
+        size, crc = RECORD.unpack(self._map[pos:pos + RECORD.size])
+        start = pos + RECORD.size
+        if start + size > end:
+            return None
+        data = self._map[start:start + size]
+        if zlib.crc32(data) & 0xffffffff != crc:
+            return None
+        return data
+
+    def _write_header(self):
+        self._map[:HEADER.size] = HEADER.pack(MAGIC, self._head, self._tail)
+
+    def append(self, data):
+        """
+        Add a payload at the tail, dropping the oldest ones if the spool is
+        full.  Returns the number of payloads dropped.
+        """
+        need = RECORD.size + len(data)
+        if HEADER.size + need > self.size:
+            raise ValueError(E_TOOBIG % (len(data), self.size))
+        dropped = 0
+        if self._tail + need > self.size:
+            while self._count and self.size - HEADER.size - self.used < need:
+                self._pop()
+                dropped += 1
+            self._compact()
+        pos = self._tail
+        record = RECORD.pack(len(data), zlib.crc32(data) & 0xffffffff)
+        self._map[pos:pos + need] = record + data
+        self._tail = pos + need
+        self._count += 1
+        self._write_header()
+        self._map.flush()
+        return dropped
+
+    def _compact(self):
+        "Move the live records to the front of the file."
+        used = self.used
+        if self._head > HEADER.size:
+            if used:
+                self._map.move(HEADER.size, self._head, used)
+            self._head = HEADER.size
+            self._tail = HEADER.size + used
+            self._write_header()
+
+    def peek(self):
+        "The oldest payload, or None when the spool is empty."
+        if not self._count:
+            return None
+        return self._read(self._head, self._tail)
+
+    def pop(self):
+        "Remove the oldest payload."
+        if self._count:
+            self._pop()
+            self._write_header()
+
+    def _pop(self):
+        size, _ = RECORD.unpack(self._map[self._head:self._head + RECORD.size])
+        self._head += RECORD.size + size
+        self._count -= 1
+        if not self._count:
+            self._head = self._tail = HEADER.size
+
+    def close(self):
+        self._map.flush()
+        self._map.close()
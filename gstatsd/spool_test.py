@@ -0,0 +1,92 @@
+
+# standard
+import os
+import shutil
+import tempfile
+import unittest
+
+# local
+from gstatsd.spool import HEADER, RECORD, Spool
+
+
+class SpoolTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp, 'host.spool')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def drain(self, spool):
+        items = []
+        while len(spool):
+            items.append(spool.peek())
+            spool.pop()
+        return items
+
+    def test_fifo(self):
+        spool = Spool(self.path, 1024)
+        self.assertEquals(spool.peek(), None)
+        for data in ('one', 'two', 'three'):
+            self.assertEquals(spool.append(data), 0)
+        self.assertEquals(len(spool), 3)
+        self.assertEquals(spool.used, 3 * RECORD.size + 11)
+        self.assertEquals(self.drain(spool), ['one', 'two', 'three'])
+        self.assertEquals(spool.used, 0)
+        spool.close()
+
+    def test_reopen(self):
+        spool = Spool(self.path, 1024)
+        for data in ('one', 'two', 'three'):
+            spool.append(data)
+        spool.pop()
+        spool.close()
+        spool = Spool(self.path, 1024)
+        self.assertEquals(self.drain(spool), ['two', 'three'])
+        spool.close()
+
+    def test_corrupt_tail(self):
+        spool = Spool(self.path, 1024)
+        spool.append('one')
+        spool.append('two')
+        spool.close()
+        # damage the last record, as if the daemon died writing it
+        with open(self.path, 'r+b') as fp:
+            fp.seek(HEADER.size + 2 * RECORD.size + 4)
+            fp.write('x')
+        spool = Spool(self.path, 1024)
+        self.assertEquals(self.drain(spool), ['one'])
+        spool.close()
+
+    def test_full(self):
+        size = HEADER.size + 3 * (RECORD.size + 10)
+        spool = Spool(self.path, size)
+        for i in range(3):
+            self.assertEquals(spool.append('%010d' % i), 0)
+        # making room drops the oldest and moves the rest to the front
+        self.assertEquals(spool.append('%010d' % 3), 1)
+        self.assertEquals(spool.append('x' * 25), 2)
+        self.assertEquals(self.drain(spool), ['%010d' % 3, 'x' * 25])
+        self.assertRaises(ValueError, spool.append, 'x' * size)
+        spool.close()
+
+    def test_compact(self):
+        size = HEADER.size + 3 * (RECORD.size + 10)
+        spool = Spool(self.path, size)
+        for i in range(3):
+            spool.append('%010d' % i)
+        spool.pop()
+        # there is room once the live records are moved up
+        self.assertEquals(spool.append('%010d' % 3), 0)
+        self.assertEquals(self.drain(spool),
+                          ['%010d' % i for i in range(1, 4)])
+        spool.close()
+
+
+def main():
+    unittest.main()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,166 @@
+
+# standard
+import bisect
+import itertools
+import math
+
+# local
+from sketch import TimerSketch
+
+# vendor
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+class TimerSummary(object):
+
+    """
+    Statistics computed for one timer key at flush time.  thresholds holds
+    a (pct, mean, upper) tuple per percent threshold, in the order given.
+    """
+
+    __slots__ = ('count', 'lower', 'upper', 'sum', 'median', 'std',
+                 'thresholds', 'bins')
+
+    def __init__(self, count, lower, upper, total, median, std, thresholds,
+                 bins=None):
+        self.count = count
+        self.lower = lower
+        self.upper = upper
+        self.sum = total
+        self.median = median
+        self.std = std
+        self.thresholds = thresholds
+        self.bins = bins
+
+
+def summarize(timers, percents, bins=None):
+    """
+    Compute a TimerSummary for every non-empty key in timers, returning a
+    list of (key, summary) pairs.  Every percent threshold for a key is
+    read from a single sort of its samples; when numpy is available the
+    samples of all keys are sorted and reduced together in one batch.
+    """
+    exact = []
+    result = []
+    for key, vals in timers.iteritems():
+        if not vals:
+            continue
+        if isinstance(vals, TimerSketch):
+            result.append((key, _summarize_sketch(vals, percents, bins)))
+        else:
+            exact.append((key, vals))
+    if exact:
+        if numpy is not None:
+            result.extend(_summarize_numpy(exact, percents, bins))
+        else:
+            result.extend((key, _summarize_exact(vals, percents, bins))
+                          for key, vals in exact)
+    return result
+
+
+def _threshold_index(pct, num):
+    "Number of samples at or below the pct threshold, rounded half up."
+    return int(math.floor((pct / 100.0) * num + 0.5))
+
+
+def _summarize_exact(vals, percents, bins):
+    num = len(vals)
+    vals = sorted(vals)
+    vmin = vals[0]
+    vmax = vals[-1]
+    total = sum(vals)
+    mean = total / num
+    std = math.sqrt(sum((val - mean) ** 2 for val in vals) / num)
+    median = (vals[(num - 1) // 2] + vals[num // 2]) / 2.0
+    thresholds = []
+    for pct in percents:
+        idx = _threshold_index(pct, num)
+        if idx:
+            thresholds.append((pct, sum(vals[:idx]) / idx, vals[idx - 1]))
+        else:
+            thresholds.append((pct, vmin, vmax))
+    counts = None
+    if bins:
+        counts = [0] * (len(bins) + 1)
+        for val in vals:
+            counts[bisect.bisect_right(bins, val)] += 1
+    return TimerSummary(num, vmin, vmax, total, median, std, thresholds,
+                        counts)
+
+
+def _summarize_sketch(vals, percents, bins):
+    num = vals.count
+    mean = vals.sum / num
+    std = math.sqrt(max(vals.sumsq / num - mean * mean, 0.0))
+    thresholds = []
+    for pct in percents:
+        _, _, pct_mean, pct_upper = vals.summary(pct)
+        thresholds.append((pct, pct_mean, pct_upper))
+    counts = vals.histogram(bins) if bins else None
+    return TimerSummary(num, vals.min, vals.max, vals.sum, vals.quantile(0.5),
+                        std, thresholds, counts)
+
+
+def _summarize_numpy(items, percents, bins):
+    keys = [key for key, _ in items]
+    lengths = numpy.fromiter((len(vals) for _, vals in items),
+                             dtype=numpy.intp, count=len(items))
+    flat = numpy.fromiter(
+        itertools.chain.from_iterable(vals for _, vals in items),
+        dtype=numpy.float64, count=int(lengths.sum()))
+
+    # one sort orders every key's samples: ids keep the keys grouped in
+    # their original order, and the samples are sorted within each group.
+    ids = numpy.repeat(numpy.arange(len(items)), lengths)
+    flat = flat[numpy.lexsort((flat, ids))]
+    starts = numpy.cumsum(lengths) - lengths
+    ends = starts + lengths
+
+    # sums are reduced per key, so a key with large samples costs the
+    # others no precision; the zero pads the end of the last segment.
+    padded = numpy.append(flat, 0.0)
+
+    lower = flat[starts]
+    upper = flat[ends - 1]
+    totals = numpy.add.reduceat(flat, starts)
+    means = totals / lengths
+    dev = flat - numpy.repeat(means, lengths)
+    std = numpy.sqrt(numpy.add.reduceat(dev * dev, starts) / lengths)
+    median = (flat[starts + (lengths - 1) // 2] + flat[starts + lengths // 2])
+    median /= 2.0
+
+    pct_means = []
+    pct_uppers = []
+    for pct in percents:
+        idx = numpy.floor((pct / 100.0) * lengths + 0.5).astype(numpy.intp)
+        valid = idx > 0
+        safe = numpy.where(valid, idx, 1)
+        bounds = numpy.column_stack((starts, starts + safe)).ravel()
+        head_sums = numpy.add.reduceat(padded, bounds)[::2]
+        pct_means.append(numpy.where(valid, head_sums / safe, lower))
+        pct_uppers.append(numpy.where(valid, flat[starts + safe - 1], upper))
+
+    counts = None
+    if bins:
+        nbins = len(bins) + 1
+        slots = ids * nbins + numpy.searchsorted(bins, flat, side='right')
+        counts = numpy.bincount(slots, minlength=len(items) * nbins)
+        counts = counts.reshape(len(items), nbins).tolist()
+
+    lower = lower.tolist()
+    upper = upper.tolist()
+    totals = totals.tolist()
+    median = median.tolist()
+    std = std.tolist()
+    lengths = lengths.tolist()
+    pct_means = [col.tolist() for col in pct_means]
+    pct_uppers = [col.tolist() for col in pct_uppers]
+    for i, key in enumerate(keys):
+        thresholds = [(pct, pct_means[j][i], pct_uppers[j][i])
+                      for j, pct in enumerate(percents)]
+        yield key, TimerSummary(lengths[i], lower[i], upper[i], totals[i],
+                                median[i], std[i], thresholds,
+                                counts[i] if counts else None)
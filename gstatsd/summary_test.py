@@ -0,0 +1,94 @@
+
+# standard
+import random
+import unittest
+
+# local
+from gstatsd import summary
+from gstatsd.sketch import TimerSketch
+
+
+class SummaryTest(unittest.TestCase):
+
+    def setUp(self):
+        rnd = random.Random(3)
+        self.timers = {
+            'one': [7.0],
+            'empty': [],
+            'few': [5.0, 1.0, 3.0, 4.0, 2.0],
+            'many': [rnd.uniform(0, 500) for i in xrange(1001)],
+            }
+        self.percents = [90.0, 50.0, 99.9]
+        self.bins = [2.5, 100.0]
+
+    def _run(self, use_numpy):
+        saved = summary.numpy
+        if not use_numpy:
+            summary.numpy = None
+        try:
+            return dict(summary.summarize(self.timers, self.percents,
+                                          self.bins))
+        finally:
+            summary.numpy = saved
+
+    def test_exact(self):
+        res = self._run(False)
+        self.assertEquals(sorted(res), ['few', 'many', 'one'])
+        few = res['few']
+        self.assertEquals((few.count, few.lower, few.upper), (5, 1.0, 5.0))
+        self.assertEquals((few.sum, few.median), (15.0, 3.0))
+        self.assertAlmostEquals(few.std, 2 ** 0.5)
+        # 90% of 5 rounds half up to 5 samples, 50% to 3
+        self.assertEquals(few.thresholds[0], (90.0, 3.0, 5.0))
+        self.assertEquals(few.thresholds[1], (50.0, 2.0, 3.0))
+        self.assertEquals(few.bins, [2, 3, 0])
+        one = res['one']
+        self.assertEquals(one.thresholds, [(p, 7.0, 7.0) for p in
+                                           self.percents])
+        self.assertEquals(one.std, 0)
+
+    def test_numpy_matches_exact(self):
+        if summary.numpy is None:
+            return
+        exact = self._run(False)
+        vector = self._run(True)
+        self.assertEquals(sorted(exact), sorted(vector))
+        for key, summ in exact.iteritems():
+            other = vector[key]
+            for attr in ('count', 'lower', 'upper', 'median', 'bins'):
+                self.assertEquals(getattr(summ, attr), getattr(other, attr))
+            self.assertAlmostEquals(summ.sum, other.sum)
+            self.assertAlmostEquals(summ.std, other.std)
+            for (p1, m1, u1), (p2, m2, u2) in zip(summ.thresholds,
+                                                  other.thresholds):
+                self.assertEquals((p1, u1), (p2, u2))
+                self.assertAlmostEquals(m1, m2)
+
+    def test_numpy_precision(self):
+        if summary.numpy is None:
+            return
+        items = [('big', [1e13, 1e13]), ('small', [0.1, 0.2, 0.3])]
+        res = dict(summary._summarize_numpy(items, [90.0], None))
+        small = res['small']
+        self.assertAlmostEquals(small.sum, 0.6)
+        self.assertAlmostEquals(small.thresholds[0][1], 0.2)
+        self.assertEquals(res['big'].sum, 2e13)
+
+    def test_sketch(self):
+        sk = TimerSketch()
+        for val in self.timers['few']:
+            sk.append(val)
+        res = dict(summary.summarize({'few': sk}, self.percents, self.bins))
+        few = res['few']
+        self.assertEquals((few.count, few.lower, few.upper), (5, 1.0, 5.0))
+        self.assertEquals(few.sum, 15.0)
+        self.assertAlmostEquals(few.std, 2 ** 0.5)
+        self.assertEquals(few.bins, [2, 3, 0])
+
+
+def main():
+    unittest.main()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+
+# standard
+import heapq
+
+
+class SpaceSaving(object):
+
+    """
+    Approximate top-k counter using the Space-Saving algorithm of Metwally,
+    Agrawal and El Abbadi.
+
+    At most capacity keys are tracked.  A key arriving when the table is
+    full takes the place of the key with the smallest count and inherits
+    that count as its error, so each reported count overestimates the true
+    one by at most its error, and every key occurring more than
+    total / capacity times is guaranteed to be tracked.  The smallest count
+    is found with a heap holding one entry per key; counts only grow, so a
+    stale entry is refreshed when it reaches the top.
+    """
+
+    __slots__ = ('capacity', 'total', '_counts', '_heap')
+
+    def __init__(self, capacity):
+        self.capacity = max(int(capacity), 1)
+        self.total = 0
+        self._counts = {}
+        self._heap = []
+
+    def __len__(self):
+        return len(self._counts)
+
+    def __getstate__(self):
+        return (self.capacity, self.total, self._counts, self._heap)
+
+    def __setstate__(self, state):
+        self.capacity, self.total, self._counts, self._heap = state
+
+    def add(self, key, weight=1):
+        "Count weight occurrences of key."
+        self.total += weight
+        counts = self._counts
+        entry = counts.get(key)
+        if entry is not None:
+            entry[0] += weight
+            return
+        heap = self._heap
+        if len(counts) < self.capacity:
+            counts[key] = [weight, 0]
+            heapq.heappush(heap, (weight, key))
+            return
+
+        # replace the key with the smallest count
+        while 1:
+            count, victim = heap[0]
+            current = counts[victim][0]
+            if current == count:
+                break
+            heapq.heapreplace(heap, (current, victim))
+        del counts[victim]
+        counts[key] = [count + weight, count]
+        heapq.heapreplace(heap, (count + weight, key))
+
+    def _floor(self):
+        "Upper bound on the count of any key that is not tracked."
+        if len(self._counts) < self.capacity:
+            return 0
+        return min(entry[0] for entry in self._counts.itervalues())
+
+    def merge(self, other):
+        """
+        Fold in another summary, e.g. a worker's.  A key tracked by only one
+        side is credited with the other side's floor, as error, before the
+        capacity largest counts are kept.
+        """
+        floor = self._floor()
+        other_floor = other._floor()
+        merged = {}
+        for key, (count, error) in self._counts.iteritems():
+            merged[key] = [count + other_floor, error + other_floor]
+        for key, (count, error) in other._counts.iteritems():
+            entry = merged.get(key)
+            if entry is None:
+                merged[key] = [count + floor, error + floor]
+            else:
+                entry[0] += count - other_floor
+                entry[1] += error - other_floor
+        keep = heapq.nlargest(self.capacity, merged.iteritems(),
+                              key=lambda item: item[1][0])
+        self._counts = dict(keep)
+        self._heap = [(entry[0], key) for key, entry in keep]
+        heapq.heapify(self._heap)
+        self.total += other.total
+
+    def top(self, num=None):
+        """
+        Return up to num (key, count, error) tuples, largest count first.
+        """
+        items = sorted(self._counts.iteritems(),
+                       key=lambda item: (-item[1][0], item[0]))
+        if num is not None:
+            items = items[:num]
+        return [(key, count, error) for key, (count, error) in items]
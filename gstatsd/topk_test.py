@@ -0,0 +1,65 @@
+
+# standard
+import cPickle
+import random
+import unittest
+
+# local
+from gstatsd.topk import SpaceSaving
+
+
+class SpaceSavingTest(unittest.TestCase):
+
+    def test_exact(self):
+        top = SpaceSaving(10)
+        for key in 'abacabaa':
+            top.add(key)
+        top.add('d', 3)
+        self.assertEquals(top.top(), [('a', 5, 0), ('d', 3, 0), ('b', 2, 0),
+                                      ('c', 1, 0)])
+        self.assertEquals(top.top(1), [('a', 5, 0)])
+        self.assertEquals(top.total, 11)
+
+    def test_heavy_hitters(self):
+        rnd = random.Random(0)
+        top = SpaceSaving(20)
+        stream = ['heavy%d' % (i % 3) for i in range(3000)]
+        stream.extend('noise%d' % i for i in range(5000))
+        rnd.shuffle(stream)
+        for key in stream:
+            top.add(key)
+        self.assertEquals(len(top), 20)
+        self.assertEquals(sorted(key for key, _, _ in top.top(3)),
+                          ['heavy0', 'heavy1', 'heavy2'])
+        for key, count, error in top.top(3):
+            self.assertTrue(count - error <= 1000 <= count)
+
+    def test_merge(self):
+        one = SpaceSaving(4)
+        two = SpaceSaving(4)
+        for key in 'aaaabbc':
+            one.add(key)
+        for key in 'aabbbbd':
+            two.add(key)
+        one.merge(two)
+        self.assertEquals(one.top(2), [('a', 6, 0), ('b', 6, 0)])
+        self.assertEquals(one.total, 14)
+        one.add('e')
+        self.assertEquals(len(one), 4)
+
+    def test_pickle(self):
+        top = SpaceSaving(2)
+        for key in 'aabc':
+            top.add(key)
+        copy = cPickle.loads(cPickle.dumps(top, cPickle.HIGHEST_PROTOCOL))
+        self.assertEquals(copy.top(), top.top())
+        copy.add('d')
+        self.assertEquals(len(copy), 2)
+
+
+def main():
+    unittest.main()
+
+
+if __name__ == '__main__':
+    main()
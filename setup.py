@@ -31,7 +31,6 @@ def main():
             "Operating System :: POSIX :: Linux",
             "Operating System :: Unix",
             "Programming Language :: Python",
-            "Programming Language :: Python :: 2.6",
             "Programming Language :: Python :: 2.7",
             "Topic :: Software Development :: Libraries :: Python Modules",
             ],